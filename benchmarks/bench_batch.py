@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Compares loading the objects of a document one by one (get_object), in a random
+order as when walking /Kids, /Resources or /Annots, with loading them in one call
+to get_objects, which reads them ordered by position.
+
+    python -m benchmarks.bench_batch [pages]
+"""
+
+__author__ = "Cyril Nicodeme"
+__author_email__ = "cyril@pdfshift.io"
+
+from pdfsurge.pdf import PDFSurge
+from pdfsurge.xref import IN_USE
+from benchmarks.bench_stream import CountingFile
+from benchmarks.synthetic import build_pdf
+import os, random, sys, time, tempfile
+
+
+def run(path, batch):
+    with open(path, 'rb') as f:
+        counting = CountingFile(f)
+        pdf = PDFSurge(counting)
+        paths = [(num, index if xref_type == IN_USE else 0) for num, xref_type, _, index in pdf.xref.items()]
+        random.Random(0).shuffle(paths)
+
+        counting.calls = counting.bytes_read = 0
+        start = time.perf_counter()
+        if batch:
+            pdf.get_objects(paths)
+        else:
+            for path in paths:
+                pdf.get_object(path)
+        elapsed = time.perf_counter() - start
+
+    return elapsed, counting.calls, counting.bytes_read
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    data = build_pdf(pages=pages, widths=256)
+
+    fd, path = tempfile.mkstemp(suffix='.pdf')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        print('File size      : {0:,} bytes'.format(len(data)))
+        for name, batch in (('get_object', False), ('get_objects', True)):
+            elapsed, calls, bytes_read = run(path, batch)
+            print('{0:<15}: {1:.3f}s, {2:,} I/O calls, {3:,} bytes read'.format(name, elapsed, calls, bytes_read))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
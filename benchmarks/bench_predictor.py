@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Compares Predictor.decode with a decoder undoing the predictors byte after byte,
+row by row, as the former implementation did, on an xref stream (PNG Up),
+an RGB image (PNG filters chosen per row) and a 16 bits TIFF predicted image.
+Both outputs are checked to be identical.
+
+    python -m benchmarks.bench_predictor [rows]
+"""
+
+__author__ = "Cyril Nicodeme"
+__author_email__ = "cyril@pdfshift.io"
+
+from pdfsurge import decoders
+from pdfsurge.decoders import Predictor
+import random, sys, time
+
+
+def reference_decode(data, predictor, columns, colors, bits):
+    """ Undoes the predictor with a loop over each byte of each row """
+    rowlength = (columns * colors * bits + 7) // 8
+    bpp = (colors * bits + 7) // 8
+    output = bytearray()
+    previous = bytearray(rowlength)
+
+    if predictor == 2:
+        width = bits // 8
+        for offset in range(0, len(data), rowlength):
+            row = data[offset:offset + rowlength]
+            samples = [int.from_bytes(row[i:i + width], 'big') for i in range(0, rowlength, width)]
+            for i in range(colors, len(samples)):
+                samples[i] = (samples[i] + samples[i - colors]) % (1 << bits)
+            output += b''.join(sample.to_bytes(width, 'big') for sample in samples)
+        return bytes(output)
+
+    for offset in range(0, len(data), rowlength + 1):
+        filterByte = data[offset]
+        row = bytearray(data[offset + 1:offset + rowlength + 1])
+        for i in range(rowlength):
+            a = row[i - bpp] if i >= bpp else 0
+            b = previous[i]
+            c = previous[i - bpp] if i >= bpp else 0
+            if filterByte == 1:
+                row[i] = (row[i] + a) % 256
+            elif filterByte == 2:
+                row[i] = (row[i] + b) % 256
+            elif filterByte == 3:
+                row[i] = (row[i] + (a + b) // 2) % 256
+            elif filterByte == 4:
+                pa, pb, pc = abs(b - c), abs(a - c), abs(a + b - 2 * c)
+                row[i] = (row[i] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) % 256
+        output += row
+        previous = row
+
+    return bytes(output)
+
+
+def png_rows(rows, columns, bpp, filters, rnd):
+    """ Random rows, each starting with one of the given filters """
+    rowlength = columns * bpp
+    return b''.join(bytes([rnd.choice(filters)]) + rnd.randbytes(rowlength) for _ in range(rows))
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rnd = random.Random(0)
+
+    cases = (
+        ('xref stream, Up', png_rows(rows * 50, 7, 1, [2], rnd), (12, 7, 1, 8)),
+        ('RGB image, Sub/Up', png_rows(rows, 1000, 3, [1, 2], rnd), (15, 1000, 3, 8)),
+        ('RGB image, all', png_rows(rows, 1000, 3, [0, 1, 2, 3, 4], rnd), (15, 1000, 3, 8)),
+        ('16 bits TIFF', rnd.randbytes(rows * 1000 * 3 * 2), (2, 1000, 3, 16)),
+    )
+
+    print('NumPy          : {0}'.format('yes' if decoders.numpy is not None else 'no'))
+    for name, data, parameters in cases:
+        reference, expected = measure(reference_decode, data, *parameters)
+        elapsed, result = measure(Predictor.decode, data, *parameters)
+        assert result == expected, 'Different output for {0}'.format(name)
+        print('{0:<18} : {1:,} bytes, {2:.3f}s -> {3:.3f}s ({4:.1f}x)'.format(name, len(data), reference, elapsed, reference / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Compares PDFSurge.probe with opening a document and reading the same details,
+on a document saved with several incremental updates (each one rewriting the
+catalog, the root of the page tree and the /Info dictionary, as a viewer
+filling a form would).
+
+Also checks that reading the document lazily (lazy_xref) gives the same trailer
+as reading it at once, when the newest update doesn't repeat /Info.
+
+    python -m benchmarks.bench_probe [pages] [updates]
+"""
+
+__author__ = "Cyril Nicodeme"
+__author_email__ = "cyril@pdfshift.io"
+
+from pdfsurge.pdf import PDFSurge
+from pdfsurge.xref import IN_USE
+from benchmarks.synthetic import build_pdf
+import io, os, sys, time, tempfile
+
+
+def add_updates(data, updates, newest_info=True):
+    """
+    Appends `updates` incremental updates to the given document.
+    Unless `newest_info` is set, the trailer of the newest update has no /Info.
+    """
+    pdf = PDFSurge(io.BytesIO(data))
+    size = pdf.trailer['/Size']
+    info = pdf.trailer['/Info'][0]
+    startxref = max(pdf._xref_sections)
+    sources = {}
+    for num in (1, 2, info):
+        xref_type, offset, _ = pdf.xref.get(num)
+        assert xref_type == IN_USE
+        sources[num] = data[offset:data.index(b'endobj', offset) + 6] + b'\n'
+
+    output = bytearray(data)
+    for revision in range(1, updates + 1):
+        offsets = {}
+        for num, source in sorted(sources.items()):
+            offsets[num] = len(output)
+            if num == info:
+                source = source.replace(b'>>', b'/Revision %d >>' % revision, 1)
+            output += source
+
+        xref_offset = len(output)
+        output += b'xref\n'
+        for num, offset in sorted(offsets.items()):
+            output += b'%d 1\n%010d 00000 n \n' % (num, offset)
+        info_entry = b'/Info %d 0 R ' % info if newest_info or revision < updates else b''
+        output += b'trailer\n<< /Size %d /Root 1 0 R %s/Prev %d >>\nstartxref\n%d\n%%%%EOF\n' % (
+            size, info_entry, startxref, xref_offset
+        )
+        startxref = xref_offset
+
+    return bytes(output)
+
+
+def open_document(path):
+    with PDFSurge.open(path) as pdf:
+        pdf.get_version()
+        pdf.page_count()
+        pdf.is_encrypted()
+        pdf.get_metadata()
+        return len(pdf._xref_sections)
+
+
+def check_lazy_trailer(data):
+    """ Checks that the trailer values don't depend on lazy_xref, nor on the order they are read in """
+    def read(pdf, order):
+        values = {}
+        for name in order:
+            values[name] = getattr(pdf, name)()
+        return values
+
+    order = ('get_metadata', 'is_encrypted', 'page_count')
+    expected = read(PDFSurge(io.BytesIO(data)), order)
+    for order in (order, order[::-1]):
+        found = read(PDFSurge(io.BytesIO(data), lazy_xref=True), order)
+        assert found == expected, (order, found, expected)
+
+
+def probe(path):
+    return PDFSurge.probe(path).xref_sections
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    updates = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    base = build_pdf(pages=pages)
+    check_lazy_trailer(add_updates(base, updates, newest_info=False))
+    data = add_updates(base, updates)
+
+    fd, path = tempfile.mkstemp(suffix='.pdf')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        print('{0:,} pages, {1} incremental updates, {2:,} bytes'.format(pages, updates, len(data)))
+        for name, runner in (('open', open_document), ('probe', probe)):
+            start = time.perf_counter()
+            sections = runner(path)
+            elapsed = time.perf_counter() - start
+            print('{0:<6}: {1:>3} xref sections read in {2:.4f}s'.format(name, sections, elapsed))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the throughput of scan_objects, which rebuilds the xref index of damaged
+documents, on a document made of small objects only and on one where most of the
+bytes are binary stream content (images, fonts), as in most real documents.
+
+The three words (obj, trailer and /Type) are searched in separate passes, as
+plain words let the regular expression engine skip to them quickly. The same
+scan with a single pattern alternating them is measured for comparison.
+
+    python -m benchmarks.bench_scan [megabytes]
+"""
+
+__author__ = "Cyril Nicodeme"
+__author_email__ = "cyril@pdfshift.io"
+
+from pdfsurge.stream import StreamReader
+from pdfsurge.xref import scan_objects, _ws, _not_regular
+from benchmarks.synthetic import build_pdf
+import os, re, sys, time
+
+_re_combined = re.compile(
+    rb'(?:(obj)|(trailer)|/Type[' + _ws + rb']*/(XRef|ObjStm|Catalog))' + _not_regular
+)
+
+
+def scan_combined(reader):
+    """ Finds the same words as scan_objects, in a single pass (the matches are not processed) """
+    for base, buffer, start, end in reader.chunks():
+        for match in _re_combined.finditer(buffer, start, end):
+            pass
+
+
+def measure(scan, data):
+    reader = StreamReader(data)
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        scan(reader)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return len(data) / best / 1e6
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+
+    dense = build_pdf(pages=20000, widths=256)
+    dense = dense * max(1, megabytes * 1000000 // len(dense))
+
+    document = build_pdf(pages=2000)
+    size = megabytes * 1000000 - len(document)
+    image = b'%d 0 obj\n<< /Type /XObject /Subtype /Image /Length %d >>\nstream\n' % (9999999, size)
+    binary = document[:9] + image + os.urandom(size) + b'\nendstream\nendobj\n' + document[9:]
+
+    for name, data in (('Small objects', dense), ('Binary streams', binary)):
+        print('{0:<15}: {1:,} bytes, scan_objects {2:,.0f} MB/s, single pattern {3:,.0f} MB/s'.format(
+            name, len(data), measure(scan_objects, data), measure(scan_combined, data)
+        ))
+
+
+if __name__ == '__main__':
+    main()
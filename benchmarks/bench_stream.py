@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the throughput of StreamReader and the number of calls it makes
+on the underlying file object while opening a document and loading every
+object listed in its xref table, and compares them with the numbers of the
+StreamReader reading one byte at a time it replaced (recorded below, on the
+same synthetic document, for the default number of pages).
+
+    python -m benchmarks.bench_stream [pages]
+"""
+
+__author__ = "Cyril Nicodeme"
+__author_email__ = "cyril@pdfshift.io"
+
+from pdfsurge.pdf import PDFSurge
+from benchmarks.synthetic import build_pdf
+import os, sys, time, tempfile
+
+# Pages: (elapsed, I/O calls, bytes read) of the one-byte StreamReader, as measured
+# by running this benchmark on the tree before the block-buffered reader
+BASELINE = {
+    2000: (1.058, 1890710, 2444943),
+}
+
+
+class CountingFile:
+    """ Wraps a binary file and counts every I/O call made on it. """
+    def __init__(self, stream):
+        self._stream = stream
+        self.mode = stream.mode
+        self.calls = 0
+        self.bytes_read = 0
+
+    def read(self, *args):
+        self.calls += 1
+        data = self._stream.read(*args)
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer):
+        self.calls += 1
+        size = self._stream.readinto(buffer)
+        self.bytes_read += size or 0
+        return size
+
+    def readline(self, *args):
+        self.calls += 1
+        data = self._stream.readline(*args)
+        self.bytes_read += len(data)
+        return data
+
+    def seek(self, *args):
+        self.calls += 1
+        return self._stream.seek(*args)
+
+    def tell(self):
+        self.calls += 1
+        return self._stream.tell()
+
+    def fileno(self):
+        return self._stream.fileno()
+
+
+def run(path):
+    with open(path, 'rb') as f:
+        counting = CountingFile(f)
+        start = time.perf_counter()
+        pdf = PDFSurge(counting)
+        for num in range(1, pdf.trailer['/Size']):
+            pdf.get_object((num, 0))
+        elapsed = time.perf_counter() - start
+
+    return elapsed, counting.calls, counting.bytes_read
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    data = build_pdf(pages=pages, widths=256)
+
+    fd, path = tempfile.mkstemp(suffix='.pdf')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        elapsed, calls, bytes_read = run(path)
+        print('File size      : {0:,} bytes'.format(len(data)))
+        print('Elapsed        : {0:.3f}s'.format(elapsed))
+        print('Throughput     : {0:,.0f} bytes/sec'.format(len(data) / elapsed))
+        print('I/O calls      : {0:,}'.format(calls))
+        print('Bytes read     : {0:,}'.format(bytes_read))
+
+        if pages in BASELINE:
+            base_elapsed, base_calls, base_bytes = BASELINE[pages]
+            print()
+            print('{0:<15}{1:>12}{2:>12}{3:>14}'.format('', 'Elapsed', 'I/O calls', 'Bytes read'))
+            print('{0:<15}{1:>11.3f}s{2:>12,}{3:>14,}'.format('One-byte reads', base_elapsed, base_calls, base_bytes))
+            print('{0:<15}{1:>11.3f}s{2:>12,}{3:>14,}'.format('StreamReader', elapsed, calls, bytes_read))
+            print('{0:<15}{1:>11.1f}x{2:>11,.0f}x{3:>13.1f}x'.format(
+                'Improvement', base_elapsed / elapsed, base_calls / calls, base_bytes / bytes_read
+            ))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Decodes the content streams of every page of a document, first from a single
+thread, then from a pool of threads sharing the same PDFSurge instance.
+zlib releases the GIL while decompressing, so large streams are decoded in parallel.
+
+    python -m benchmarks.bench_threads [pages] [threads]
+"""
+
+__author__ = "Cyril Nicodeme"
+__author_email__ = "cyril@pdfshift.io"
+
+from pdfsurge.pdf import PDFSurge
+from pdfsurge.cache import ObjectCache
+from benchmarks.synthetic import build_pdf
+from concurrent.futures import ThreadPoolExecutor
+import os, sys, time, tempfile
+
+
+def decode(pdf, path):
+    page = pdf.get_object(path)
+    return len(pdf.get_object(page.properties['/Contents']).get_data())
+
+
+def run(path, threads):
+    with PDFSurge.open(path, lazy_streams=True, cache=ObjectCache(max_bytes=64 * 1024 * 1024)) as pdf:
+        pdf.get_pages()
+        pages = pdf._pages
+
+        start = time.perf_counter()
+        if threads > 1:
+            with ThreadPoolExecutor(threads) as executor:
+                size = sum(executor.map(lambda page: decode(pdf, page), pages))
+        else:
+            size = sum(decode(pdf, page) for page in pages)
+
+        return time.perf_counter() - start, size
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    data = build_pdf(pages=pages, content_size=4 * 1024 * 1024)
+
+    fd, path = tempfile.mkstemp(suffix='.pdf')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        print('File size      : {0:,} bytes'.format(len(data)))
+        for count in (1, threads):
+            elapsed, size = run(path, count)
+            print('{0:>2} thread(s)   : {1:.3f}s, {2:,} bytes decoded'.format(count, elapsed, size))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
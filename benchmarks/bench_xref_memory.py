@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the memory used by a synthetic cross-reference index of 2M objects
+(one third of them compressed in object streams), stored either as the former
+dict-of-dicts + dict of tuples, or as an XrefIndex.
+
+    python -m benchmarks.bench_xref_memory [objects]
+"""
+
+__author__ = "Cyril Nicodeme"
+__author_email__ = "cyril@pdfshift.io"
+
+from pdfsurge.xref import XrefIndex, IN_USE, COMPRESSED
+import sys, time, tracemalloc
+
+
+def entries(count):
+    """ Yields (num, type, field, index) entries, every third object being compressed """
+    for num in range(1, count):
+        if num % 3 == 0:
+            yield num, COMPRESSED, count + num // 300, (num // 3) % 100
+        else:
+            yield num, IN_USE, num * 731, 0
+
+
+def build_dicts(count):
+    xref, compressed = {}, {}
+    for num, xref_type, field, index in entries(count):
+        if xref_type == IN_USE:
+            xref.setdefault(num, {})[index] = field
+        else:
+            compressed[num] = (field, index, 2)
+
+    return xref, compressed
+
+
+def build_index(count):
+    index = XrefIndex(count)
+    types, fields, indexes = [], [], []
+    for _, xref_type, field, idx in entries(count):
+        types.append(xref_type)
+        fields.append(field)
+        indexes.append(idx)
+
+    index.update(1, types, fields, indexes)
+    return index
+
+
+def measure(builder, count):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = builder(count)
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+
+    for name, builder in (('dict of dicts', build_dicts), ('XrefIndex', build_index)):
+        size, elapsed = measure(builder, count)
+        print('{0:<15}: {1:>12,} bytes ({2:6.1f} bytes/object) built in {3:.2f}s'.format(
+            name, size, size / count, elapsed
+        ))
+
+
+if __name__ == '__main__':
+    main()
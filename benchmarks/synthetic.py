@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Builds synthetic PDF documents used by the benchmarks.
+
+The generated files are valid enough for PDFSurge to open them: a catalog,
+a balanced page tree, one content stream per page and either a classic xref
+table or a cross-reference stream (PDF 1.5+), optionally with the dictionaries
+packed in object streams.
+"""
+
+__author__ = "Cyril Nicodeme"
+__author_email__ = "cyril@pdfshift.io"
+
+import zlib
+
+
+def build_pdf(pages=1000, fanout=10, content_size=512, widths=0, xref_stream=False, object_streams=0):
+    """
+    Returns the bytes of a PDF document containing `pages` pages, grouped
+    in a page tree where each /Pages node has at most `fanout` kids.
+    When `widths` is set, a font with a /Widths array of that many entries
+    is shared by every page.
+    When `object_streams` is set, every object that is not a stream is stored
+    in an /ObjStm holding up to that many objects (implies `xref_stream`).
+    """
+    objects = {}
+    next_num = [3]  # 1 is the catalog, 2 the root /Pages
+
+    def new_num():
+        num = next_num[0]
+        next_num[0] += 1
+        return num
+
+    font_num = None
+    if widths:
+        font_num = new_num()
+        objects[font_num] = (
+            '<< /Type /Font /Subtype /TrueType /BaseFont /Helvetica /FirstChar 0 '
+            '/Widths [{0}] >>'.format(' '.join(str(500 + (i % 250)) for i in range(widths)))
+        ).encode('ascii')
+
+    content = b'BT /F1 12 Tf 72 712 Td (Hello World) Tj ET\n' * max(1, content_size // 44)
+    content = zlib.compress(content)
+
+    page_nums = []
+    for i in range(pages):
+        stream_num = new_num()
+        objects[stream_num] = b''.join([
+            '<< /Length {0} /Filter /FlateDecode >>\nstream\n'.format(len(content)).encode('ascii'),
+            content,
+            b'\nendstream'
+        ])
+        page_nums.append((new_num(), stream_num))
+
+    # Building the page tree bottom-up
+    level = [(num, 1) for num, _ in page_nums]
+    parents = {}
+    while len(level) > fanout:
+        next_level = []
+        for i in range(0, len(level), fanout):
+            kids = level[i:i + fanout]
+            num = new_num()
+            count = sum(c for _, c in kids)
+            objects[num] = (kids, count)
+            for kid, _ in kids:
+                parents[kid] = num
+            next_level.append((num, count))
+        level = next_level
+
+    objects[2] = (level, sum(c for _, c in level))
+    for kid, _ in level:
+        parents[kid] = 2
+
+    for (num, stream_num) in page_nums:
+        resources = '<< /Font << /F1 {0} 0 R >> >>'.format(font_num) if font_num else '<< >>'
+        objects[num] = (
+            '<< /Type /Page /Parent {0} 0 R /MediaBox [0 0 612 792] '
+            '/Resources {1} /Contents {2} 0 R >>'.format(parents[num], resources, stream_num)
+        ).encode('ascii')
+
+    for num, value in list(objects.items()):
+        if isinstance(value, tuple):
+            kids, count = value
+            parent = ' /Parent {0} 0 R'.format(parents[num]) if num in parents else ''
+            objects[num] = (
+                '<< /Type /Pages{0} /Kids [{1}] /Count {2} >>'.format(
+                    parent, ' '.join('{0} 0 R'.format(k) for k, _ in kids), count
+                )
+            ).encode('ascii')
+
+    info_num = new_num()
+    objects[info_num] = b'<< /Producer (PDFSurge benchmarks) /Title (Synthetic document) >>'
+    objects[1] = b'<< /Type /Catalog /Pages 2 0 R >>'
+
+    size = next_num[0]
+    if object_streams:
+        return _write_compressed(objects, size, info_num, object_streams)
+
+    output = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = [0] * size
+    for num in range(1, size):
+        offsets[num] = len(output)
+        output += '{0} 0 obj\n'.format(num).encode('ascii')
+        output += objects[num]
+        output += b'\nendobj\n'
+
+    if xref_stream:
+        entries = [(0, 0, 65535)] + [(1, offsets[num], 0) for num in range(1, size)]
+        return bytes(_write_xref_stream(output, entries, info_num))
+
+    startxref = len(output)
+    output += 'xref\n0 {0}\n'.format(size).encode('ascii')
+    output += b'0000000000 65535 f\r\n'
+    for num in range(1, size):
+        output += '{0:010d} 00000 n\r\n'.format(offsets[num]).encode('ascii')
+
+    output += 'trailer\n<< /Size {0} /Root 1 0 R /Info {1} 0 R >>\nstartxref\n{2}\n%%EOF\n'.format(
+        size, info_num, startxref
+    ).encode('ascii')
+
+    return bytes(output)
+
+
+def _write_compressed(objects, size, info_num, per_stream):
+    output = bytearray(b'%PDF-1.5\n%\xe2\xe3\xcf\xd3\n')
+    entries = [(0, 0, 65535)] + [None] * (size - 1)
+
+    compressible = [num for num in range(1, size) if b'stream\n' not in objects[num]]
+    for num in range(1, size):
+        if b'stream\n' in objects[num]:
+            entries[num] = (1, len(output), 0)
+            output += '{0} 0 obj\n'.format(num).encode('ascii') + objects[num] + b'\nendobj\n'
+
+    next_num = size
+    for i in range(0, len(compressible), per_stream):
+        members = compressible[i:i + per_stream]
+        header, body = [], bytearray()
+        for index, num in enumerate(members):
+            header.append('{0} {1}'.format(num, len(body)))
+            body += objects[num] + b'\n'
+            entries[num] = (2, next_num, index)
+
+        header = ' '.join(header).encode('ascii') + b'\n'
+        data = zlib.compress(header + bytes(body))
+        entries.append((1, len(output), 0))
+        output += '{0} 0 obj\n<< /Type /ObjStm /N {1} /First {2} /Length {3} /Filter /FlateDecode >>\nstream\n'.format(
+            next_num, len(members), len(header), len(data)
+        ).encode('ascii')
+        output += data + b'\nendstream\nendobj\n'
+        next_num += 1
+
+    return bytes(_write_xref_stream(output, entries, info_num))
+
+
+def _write_xref_stream(output, entries, info_num):
+    num = len(entries)
+    entries.append((1, len(output), 0))  # The xref stream itself
+
+    data = b''.join(
+        kind.to_bytes(1, 'big') + field.to_bytes(4, 'big') + index.to_bytes(2, 'big')
+        for kind, field, index in entries
+    )
+    data = zlib.compress(data)
+
+    startxref = len(output)
+    output += (
+        '{0} 0 obj\n<< /Type /XRef /Size {1} /W [1 4 2] /Root 1 0 R /Info {2} 0 R '
+        '/Length {3} /Filter /FlateDecode >>\nstream\n'
+    ).format(num, len(entries), info_num, len(data)).encode('ascii')
+    output += data + b'\nendstream\nendobj\n'
+    output += 'startxref\n{0}\n%%EOF\n'.format(startxref).encode('ascii')
+
+    return output
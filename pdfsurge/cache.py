@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+__author__ = "Cyril Nicodeme"
+__author_email__ = "cyril@pdfshift.io"
+
+from collections import OrderedDict
+import threading
+
+
+class ObjectCache:
+    """
+    Least-recently-used cache for the objects loaded by PDFSurge.
+
+    The cache can be bounded by a number of objects (`max_objects`) and/or a number
+    of bytes (`max_bytes`), the least recently used entries being evicted first.
+    None means no limit, which is the default.
+    Pinned entries (the catalog, the page tree, ...) are never evicted, and are not
+    counted in these limits: pinning many page tree nodes doesn't leave the other
+    objects without room.
+    Sizes are estimated when an entry is stored, and refreshed each time it is
+    accessed, since streams are usually decoded after the object was loaded.
+
+    The cache is thread-safe. Any object implementing get/put/pin/clear can be given
+    to PDFSurge instead, as long as it is thread-safe too when the document is used
+    from several threads.
+    """
+    # Rough size of an entry without its streams content (dict, object, ...)
+    entry_size = 256
+
+    def __init__(self, max_objects=None, max_bytes=None):
+        self.max_objects = max_objects
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()  # key: (value, size)
+        self._pinned = {}
+        self._pinned_keys = set()
+        self._bytes = 0  # Of the unpinned entries
+        self._pinned_bytes = 0
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries) + len(self._pinned)
+
+    def __contains__(self, key):
+        return key in self._pinned or key in self._entries
+
+    @classmethod
+    def sizeof(cls, value):
+        """ Estimates the memory used by a cached value, counting its loaded streams contents """
+        size = cls.entry_size
+        if hasattr(value, 'memory_size'):
+            size += value.memory_size()
+
+        return size
+
+    def get(self, key):
+        """ Returns the cached value for the given key, or None """
+        with self._lock:
+            if key in self._pinned:
+                self.hits += 1
+                value, size = self._pinned[key]
+                current = self.sizeof(value)
+                if current != size:
+                    self._pinned[key] = (value, current)
+                    self._pinned_bytes += current - size
+
+                return value
+
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+
+            # The content may have been decoded since it was cached
+            value, size = entry
+            current = self.sizeof(value)
+            if current != size:
+                self._entries[key] = (value, current)
+                self._bytes += current - size
+                self._evict(keep=key)
+
+            return value
+
+    def put(self, key, value, size=None):
+        with self._lock:
+            if size is None:
+                size = self.sizeof(value)
+
+            self.discard(key)
+            if key in self._pinned_keys:
+                self._pinned[key] = (value, size)
+                self._pinned_bytes += size
+            else:
+                self._entries[key] = (value, size)
+                self._bytes += size
+                self._evict()
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._pinned.pop(key, None)
+            if entry is not None:
+                self._pinned_bytes -= entry[1]
+                return
+
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def pin(self, key):
+        """ Prevents the given key from being evicted, now or once it is cached """
+        with self._lock:
+            self._pinned_keys.add(key)
+            if key in self._entries:
+                self._pinned[key] = entry = self._entries.pop(key)
+                self._bytes -= entry[1]
+                self._pinned_bytes += entry[1]
+
+    def unpin(self, key):
+        with self._lock:
+            self._pinned_keys.discard(key)
+            if key in self._pinned:
+                self._entries[key] = entry = self._pinned.pop(key)
+                self._pinned_bytes -= entry[1]
+                self._bytes += entry[1]
+                self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pinned.clear()
+            self._bytes = self._pinned_bytes = 0
+
+    def _evict(self, keep=None):
+        while len(self._entries) > (keep is not None) and (
+            (self.max_objects is not None and len(self._entries) > self.max_objects) or
+            (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            if next(iter(self._entries)) == keep:
+                self._entries.move_to_end(keep)
+            _, (value, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        """ Returns the counters of the cache, to size it from measurements """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'objects': len(self),
+                'pinned': len(self._pinned),
+                'bytes': self._bytes + self._pinned_bytes,
+                'pinned_bytes': self._pinned_bytes
+            }
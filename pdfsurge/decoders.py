@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 
 from .exceptions import PDFSurgeDecoderException
-from .utils import lzw
+from .stream import WHITESPACES
 from io import BytesIO
-import zlib, struct, math
+import base64, itertools, zlib, struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 __author__ = "Cyril Nicodeme"
 __author_email__ = "cyril@pdfshift.io"
@@ -44,6 +49,39 @@ class Filters(object):
         else:
             raise NotImplementedError('Filter {0} not supported. Please open a ticket or a Pull Request.'.format(filter))
     
+    @staticmethod
+    def iter_decode(chunks, filter, parameters=None, chunk_size=64 * 1024):
+        """
+        Decode the data given as an iterable of chunks, and yields the decoded data
+        by chunks of about `chunk_size` bytes, so the whole data is never held in memory.
+        Filters that need the whole data (CCITTFax, JBIG2, Crypt) are decoded at once.
+        """
+        if parameters is None:
+            parameters = {}
+
+        chunks = (chunk for chunk in chunks if chunk)
+        if filter == '/ASCII85Decode' or filter == '/A85':
+            return ASCII85Decoder.iter_decode(chunks)
+        elif filter == '/ASCIIHexDecode' or filter == '/AHx':
+            return ASCIIHexDecoder.iter_decode(chunks)
+        elif filter == '/FlateDecode' or filter == '/Fl':
+            return FlateDecoder.iter_decode(chunks, parameters, chunk_size)
+        elif filter == '/LZWDecode' or filter == '/LZW':
+            return LZWDecoder.iter_decode(chunks, parameters, chunk_size)
+        elif filter == '/RunLengthDecode' or filter == '/RL':
+            return RunLengthDecode.iter_decode(chunks)
+        elif filter in ('/DCTDecode', '/DCT', '/JPXDecode'):
+            # Nothing to do here
+            return chunks
+        else:
+            return Filters._iter_whole(chunks, filter, parameters)
+
+    @staticmethod
+    def _iter_whole(chunks, filter, parameters):
+        data = Filters.decode(b''.join(chunks), filter, parameters)
+        if data:
+            yield data
+
     @staticmethod
     def encode(data, filter, parameters=None):
         """
@@ -175,35 +213,47 @@ class ASCII85Decoder(object):
 
     @classmethod
     def decode(cls, data):
-        '''
-        Method to decode datas using ASCII85
-
-        @param data: A PDF data
-        @return: A tuple (status,statusContent), where statusContent is the decoded PDF data in case status = 0 or an error in case status = -1
-        '''
-        n = b = 0
-        out = b''
+        """ Decodes the given ASCII85 data at once """
+        return b''.join(cls.iter_decode((data, )))
+
+    @classmethod
+    def iter_decode(cls, chunks):
+        """
+        Decodes ASCII85 data given by chunks. The characters of an incomplete group
+        at the end of a chunk are kept until the next one.
+        """
+        pending = b''
+        first = True
+        for chunk in chunks:
+            data = pending + bytes(chunk).translate(None, WHITESPACES)
+            if first:
+                if len(data) < 2:
+                    pending = data
+                    continue
+                if data[:2] == b'<~':
+                    data = data[2:]
+                first = False
+
+            end = data.find(b'~')
+            if end > -1:
+                pending = data[:end]
+                break
+
+            # Groups are counted from the last "z", which stands for a whole group
+            cut = len(data) - (len(data) - data.rfind(b'z') - 1) % 5
+            pending = data[cut:]
+            if cut:
+                yield cls._decode_groups(data[:cut])
+
+        if pending:
+            yield cls._decode_groups(pending)
+
+    @classmethod
+    def _decode_groups(cls, data):
         try:
-            for c in data:
-                if b'!' <= c and c <= b'u':
-                    n += 1
-                    b = b*85+(ord(c)-33)
-                    if n == 5:
-                        out += struct.pack('>L', b)
-                        n = b = 0
-                elif c == b'z':
-                    assert n == 0
-                    out += b'\0\0\0\0'
-                elif c == b'~':
-                    if n:
-                        for _ in range(5-n):
-                            b = b*85+84
-                        out += struct.pack('>L', b)[:n-1]
-                    break
-        except:
-            raise PDFSurgeDecoderException('Unspecified error in ASCII85Decoder while decoding.')
-
-        return out
+            return base64.a85decode(data)
+        except ValueError:
+            raise PDFSurgeDecoderException('Invalid data in ASCII85Decoder while decoding.')
 
     @classmethod
     def encode(cls, data):
@@ -244,21 +294,42 @@ class RunLengthDecode(object):
             (2 to 128) times during decompression. A length value of 128
             denotes EOD.
         """
-        decoded = []
-        i = 0
-        while i < len(data):
-            length = ord(data[i])
-            if length == 128:
-                break
-            if length >= 0 and length < 128:
-                run = data[i+1:(i+1)+(length+1)]
-                decoded.append(run)
-                i = (i+1) + (length+1)
-            if length > 128:
-                run = data[i+1]*(257-length)
-                decoded.append(run)
-                i = (i+1) + 1
-        return b''.join(decoded)
+        return b''.join(cls.iter_decode((data, )))
+
+    @classmethod
+    def iter_decode(cls, chunks):
+        """ Decodes runs given by chunks, a run cut by the end of a chunk being completed by the next one """
+        pending = bytearray()
+        for chunk in chunks:
+            pending += chunk
+            decoded = []
+            i = 0
+            size = len(pending)
+            while i < size:
+                length = pending[i]
+                if length == 128:
+                    # EOD
+                    if decoded:
+                        yield b''.join(decoded)
+                    return
+                elif length < 128:
+                    if i + length + 2 > size:
+                        break
+                    decoded.append(bytes(pending[i + 1:i + length + 2]))
+                    i += length + 2
+                else:
+                    if i + 2 > size:
+                        break
+                    decoded.append(bytes(pending[i + 1:i + 2]) * (257 - length))
+                    i += 2
+
+            del pending[:i]
+            if decoded:
+                yield b''.join(decoded)
+
+        if len(pending) > 1:
+            # Truncated literal run
+            yield bytes(pending[1:])
     
     @classmethod
     def encode(cls, data):
@@ -318,23 +389,35 @@ class ASCIIHexDecoder(object):
     """
     @classmethod
     def decode(cls, data):
-        retval = b""
-        char = b""
-        x = 0
-        while True:
-            c = data[x]
-            if c == b">":
+        return b''.join(cls.iter_decode((data, )))
+
+    @classmethod
+    def iter_decode(cls, chunks):
+        """ Decodes hexadecimal digits given by chunks, an odd digit at the end of a chunk being kept for the next one """
+        pending = b''
+        for chunk in chunks:
+            data = pending + bytes(chunk).translate(None, WHITESPACES)
+            end = data.find(b'>')
+            if end > -1:
+                pending = data[:end]
                 break
-            elif c.isspace():
-                x += 1
-                continue
-            char += c
-            if len(char) == 2:
-                retval += chr(int(char, base=16))
-                char = b""
-            x += 1
-        assert char == b""
-        return retval
+
+            cut = len(data) & ~1
+            pending = data[cut:]
+            if cut:
+                yield cls._decode_digits(data[:cut])
+
+        if pending:
+            if len(pending) % 2:
+                pending += b'0'
+            yield cls._decode_digits(pending)
+
+    @classmethod
+    def _decode_digits(cls, data):
+        try:
+            return bytes.fromhex(data.decode('latin-1'))
+        except ValueError:
+            raise PDFSurgeDecoderException('Invalid hexadecimal data in ASCIIHexDecoder.')
 
     @classmethod
     def encode(cls, data):
@@ -415,109 +498,450 @@ class Predictor(object):
     """
     @classmethod
     def encode(cls, data, predictor, columns, colors, bits):
-        # TODO: To change, implementing and improving predictors 2, 10-15 ; and filter bytes 0 -> 4
-
-        output = b''
-        # PNG prediction
-        if predictor >= 10 and predictor <= 15:
-            # PNG prediction can vary from row to row
-            for row in range(math.ceil(len(data) / columns)):
-                rowdata = [x for x in data[(row * columns):((row + 1) * columns)]]
-                filterByte = predictor - 10
-                rowdata = [filterByte] + rowdata
-                if filterByte == 0:
-                    pass
-                elif filterByte == 1:
-                    for i in range(len(rowdata) - 1, 1, -1):
-                        if rowdata[i] < rowdata[i - 1]:
-                            rowdata[i] = rowdata[i] + 256 - rowdata[i - 1]
-                        else:
-                            rowdata[i] = rowdata[i] - rowdata[i - 1]
+        """
+        Applies the predictor to the data, as bytes.
+        Predictors 10 to 14 use the same PNG filter on every row, and 15 picks the filter of each row
+        giving the smallest sum of absolute differences (the bytes being seen as signed), as libpng does.
+        """
+        if predictor == 1:
+            return data
+
+        return b''.join(cls.iter_encode((data, ), predictor, columns, colors, bits))
+
+    @classmethod
+    def iter_encode(cls, chunks, predictor, columns, colors, bits):
+        """
+        Applies the predictor to the rows given by chunks, yielding the complete rows of each chunk.
+        Only the previous row and the incomplete one are kept between two chunks.
+        """
+        if predictor == 1:
+            yield from chunks
+            return
+
+        if predictor != 2 and not (predictor >= 10 and predictor <= 15):
+            raise PDFSurgeDecoderException('Unsupported predictor {0} on {1}.'.format(predictor, cls.__name__))
+
+        rowlength = (columns * colors * bits + 7) // 8
+        bpp = (colors * bits + 7) // 8
+
+        pending = bytearray()
+        previous = b''
+        for chunk in chunks:
+            pending += chunk
+            rows = len(pending) // rowlength
+            if not rows:
+                continue
+
+            block = bytes(pending[:rows * rowlength])
+            del pending[:rows * rowlength]
+            yield cls._encode_rows(block, previous, rowlength, bpp, predictor, columns, colors, bits)
+            previous = block[-rowlength:]
+
+        if pending:
+            # The last row is completed with zeros, and cut once encoded
+            size = len(pending) + (1 if predictor >= 10 else 0)
+            pending += bytes(rowlength - len(pending))
+            yield cls._encode_rows(bytes(pending), previous, rowlength, bpp, predictor, columns, colors, bits)[:size]
+
+    @classmethod
+    def _encode_rows(cls, data, previous, rowlength, bpp, predictor, columns, colors, bits):
+        if predictor == 2:
+            return cls._encode_tiff_rows(data, rowlength, columns, colors, bits)
+
+        # The previous row is encoded again, so PNG Up, Average and Paeth see it above the first row
+        return cls._encode_png_rows(previous + data, rowlength, bpp, predictor)[len(previous) + len(previous) // rowlength:]
+
+    @classmethod
+    def parameters(cls, parameters):
+        """ Returns the (predictor, columns, colors, bits) values of the given /DecodeParms """
+        predictor = parameters.get('/Predictor', 1)
+        columns = parameters.get('/Columns', 1)
+        colors = parameters.get('/Colors', 1)
+        bits = parameters.get('/BitsPerComponent', 8)
+
+        if columns < 1:
+            columns = 1
+
+        if colors < 1:
+            colors = 1
+
+        if bits not in [1, 2, 4, 8, 16]:
+            bits = 8
+
+        return predictor, columns, colors, bits
+
+    @classmethod
+    def decode(cls, decoded, predictor, columns, colors, bits):
+        if predictor == 1:
+            return decoded
+
+        return b''.join(cls.iter_decode((decoded, ), predictor, columns, colors, bits))
+
+    @classmethod
+    def iter_decode(cls, chunks, predictor, columns, colors, bits):
+        """
+        Decodes the rows given by chunks, yielding the complete rows of each chunk.
+        Only the previous row and the incomplete one are kept between two chunks.
+        """
+        if predictor == 1:
+            yield from chunks
+            return
+
+        if predictor != 2 and not (predictor >= 10 and predictor <= 15):
+            raise PDFSurgeDecoderException('Unsupported predictor {0} on {1}.'.format(predictor, cls.__name__))
+
+        png = predictor >= 10
+        rowlength = (columns * colors * bits + 7) // 8
+        # PNG rows start with the filter byte
+        stride = rowlength + 1 if png else rowlength
+        # Bytes per complete pixel, rounded up, at least one
+        bpp = (colors * bits + 7) // 8
+
+        pending = bytearray()
+        previous = bytes(rowlength)
+        for chunk in chunks:
+            pending += chunk
+            rows = len(pending) // stride
+            if not rows:
+                continue
+
+            if png:
+                output = cls._decode_png_rows(pending[:rows * stride], rowlength, previous, bpp)
+                previous = output[-rowlength:]
+            else:
+                output = cls._decode_tiff_rows(pending[:rows * stride], rowlength, columns, colors, bits)
+
+            del pending[:rows * stride]
+            yield output
+
+        if pending:
+            # The last row is truncated, it is completed with zeros to decode its available bytes
+            size = len(pending) - 1 if png else len(pending)
+            pending += bytes(stride - len(pending))
+            if png:
+                output = cls._decode_png_rows(pending, rowlength, previous, bpp)
+            else:
+                output = cls._decode_tiff_rows(pending, rowlength, columns, colors, bits)
+            yield output[:size]
+
+    @classmethod
+    def _decode_png_rows(cls, data, rowlength, previous, bpp):
+        """
+        Reverts the PNG filters of complete rows (each starting with its filter byte), given the previous decoded row.
+        Consecutive rows using the same filter are decoded at once when NumPy is available:
+        Sub is a cumulative sum along the pixels of the rows, and Up a cumulative sum down the rows.
+        Average and Paeth depend on the byte decoded just before, and are decoded byte after byte.
+        """
+        stride = rowlength + 1
+        rows = len(data) // stride
+
+        if numpy is not None:
+            encoded = numpy.frombuffer(data, dtype=numpy.uint8).reshape(rows, stride)
+            filters = encoded[:, 0]
+            if rows and filters.max() > 4:
+                raise PDFSurgeDecoderException("Unsupported PNG filter {0}".format(int(filters.max())))
+
+            output = encoded[:, 1:].copy()
+            last = numpy.frombuffer(previous, dtype=numpy.uint8)
+            # Runs of consecutive rows using the same filter
+            starts = [0] + (numpy.flatnonzero(filters[1:] != filters[:-1]) + 1).tolist()
+            for start, end in zip(starts, starts[1:] + [rows]):
+                filterByte = filters[start]
+                block = output[start:end]
+                if filterByte == 1:
+                    # sub
+                    width = -(-rowlength // bpp) * bpp
+                    pixels = numpy.zeros((end - start, width), dtype=numpy.uint8)
+                    pixels[:, :rowlength] = block
+                    pixels = pixels.reshape(end - start, width // bpp, bpp).cumsum(axis=1, dtype=numpy.uint8)
+                    block[:] = pixels.reshape(end - start, width)[:, :rowlength]
+                elif filterByte == 2:
+                    # up
+                    block.cumsum(axis=0, dtype=numpy.uint8, out=block)
+                    block += last
+                elif filterByte == 3 or filterByte == 4:
+                    for row in range(start, end):
+                        rowdata = bytearray(output[row].tobytes())
+                        cls._decode_png_row(rowdata, last.tobytes(), filterByte, bpp)
+                        output[row] = numpy.frombuffer(rowdata, dtype=numpy.uint8)
+                        last = output[row]
+
+                last = output[end - 1]
+
+            return output.tobytes()
+
+        # Without NumPy, rows are handled as integers whose bytes are added at once (see _lanes_add)
+        output = bytearray()
+        high, low = _lanes_masks(rowlength * 8, 8)
+        start = 0
+        for filterByte, run in itertools.groupby(data[:rows * stride:stride]):
+            count = len(list(run))
+            block = bytearray(data[start * stride:(start + count) * stride])
+            # Removes the filter bytes
+            del block[::stride]
+            start += count
+
+            if filterByte == 0:
+                output += block
+            elif filterByte == 2:
+                # up, the cumulative sum of the rows following the previous one
+                size = (count + 1) * rowlength * 8
+                value = _lanes_scan(int.from_bytes(previous + block, 'big'), size, rowlength * 8, *_lanes_masks(size, 8))
+                output += value.to_bytes(size // 8, 'big')[rowlength:]
+            elif filterByte == 1:
+                # sub
+                for offset in range(0, count * rowlength, rowlength):
+                    value = _lanes_scan(int.from_bytes(block[offset:offset + rowlength], 'big'), rowlength * 8, bpp * 8, high, low)
+                    output += value.to_bytes(rowlength, 'big')
+            else:
+                for offset in range(0, count * rowlength, rowlength):
+                    previous = cls._decode_png_row(block[offset:offset + rowlength], previous, filterByte, bpp)
+                    output += previous
+
+            previous = bytes(output[-rowlength:])
+
+        return bytes(output)
+
+    @classmethod
+    def _decode_png_row(cls, rowdata, previous, filterByte, bpp):
+        """ Reverts the PNG filter of a row (without its filter byte, as a bytearray) in place, given the previous decoded row """
+        rowlength = len(rowdata)
+        if filterByte == 0:
+            pass
+        elif filterByte == 1:
+            # sub
+            for i in range(bpp, rowlength):
+                rowdata[i] = (rowdata[i] + rowdata[i - bpp]) & 0xff
+        elif filterByte == 2:
+            # up
+            for i in range(rowlength):
+                rowdata[i] = (rowdata[i] + previous[i]) & 0xff
+        elif filterByte == 3:
+            # average
+            for i in range(min(bpp, rowlength)):
+                rowdata[i] = (rowdata[i] + (previous[i] >> 1)) & 0xff
+            for i in range(bpp, rowlength):
+                rowdata[i] = (rowdata[i] + ((rowdata[i - bpp] + previous[i]) >> 1)) & 0xff
+        elif filterByte == 4:
+            # paeth, the first pixel has no left neighbours so it is predicted by the byte above
+            for i in range(min(bpp, rowlength)):
+                rowdata[i] = (rowdata[i] + previous[i]) & 0xff
+            for i in range(bpp, rowlength):
+                # fetch pixels
+                a = rowdata[i - bpp]
+                b = previous[i]
+                c = previous[i - bpp]
+
+                # distances to surrounding pixels
+                pa = b - c
+                pb = a - c
+                pc = pa + pb
+                if pa < 0:
+                    pa = -pa
+                if pb < 0:
+                    pb = -pb
+                if pc < 0:
+                    pc = -pc
+
+                # pick predictor with the shortest distance
+                if pa <= pb and pa <= pc:
+                    rowdata[i] = (rowdata[i] + a) & 0xff
+                elif pb <= pc:
+                    rowdata[i] = (rowdata[i] + b) & 0xff
                 else:
-                    raise PDFSurgeDecoderException('Unsupported filter bype {0} on {1}.'.format(filterByte, cls.__name__))
-                output += (''.join([chr(x) for x in rowdata]))
-            return output
+                    rowdata[i] = (rowdata[i] + c) & 0xff
         else:
-            raise PDFSurgeDecoderException('Unsupported predictor on {0}.'.format(cls.__name__))
-    
+            raise PDFSurgeDecoderException("Unsupported PNG filter {0}".format(filterByte))
+
+        return rowdata
+
     @classmethod
-    def decode(cls, decoded, predictor, columns, colors, bits):
-        def decode_row(rowdata, prev_rowdata):
-            if predictor == 1:
-                return rowdata
-            if predictor == 2:
-                #TIFF_PREDICTOR
-                bpp = (bits + 7) / 8
-                for i in range(bpp+1, rowlength):
-                    rowdata[i] = (rowdata[i] + rowdata[i-bpp]) % 256
-            # PNG prediction
-            elif predictor >= 10 and predictor <= 15:
-                filterByte = rowdata[0]
+    def _decode_tiff_rows(cls, data, rowlength, columns, colors, bits):
+        """
+        Reverts the TIFF predictor 2 of complete rows: each component is the difference with the same
+        component of the previous pixel, so the rows are a cumulative sum of their components modulo 2**bits.
+        """
+        rows = len(data) // rowlength
+        if numpy is not None and bits >= 8:
+            dtype = numpy.dtype(numpy.uint8 if bits == 8 else '>u2')
+            samples = numpy.frombuffer(data, dtype=dtype).reshape(rows, columns, colors)
+            return samples.cumsum(axis=1, dtype=dtype.newbyteorder('=')).astype(dtype).tobytes()
+
+        # The padding bits ending the rows are not components, and are kept as is
+        padding = rowlength * 8 - columns * colors * bits
+        high, low = _lanes_masks(rowlength * 8, bits)
+        output = bytearray()
+        for offset in range(0, rows * rowlength, rowlength):
+            value = int.from_bytes(data[offset:offset + rowlength], 'big')
+            scanned = _lanes_scan(value, rowlength * 8, colors * bits, high, low)
+            if padding:
+                scanned = (scanned >> padding << padding) | (value & ((1 << padding) - 1))
+            output += scanned.to_bytes(rowlength, 'big')
+
+        return bytes(output)
+
+    @classmethod
+    def _encode_png_rows(cls, data, rowlength, bpp, predictor):
+        """
+        Applies the PNG filters to complete rows, each encoded row starting with its filter byte.
+        Unlike decoding, the filters only depend on the original bytes, so they are computed on the whole data at once.
+        """
+        rows = len(data) // rowlength
+        filters = range(5) if predictor == 15 else (predictor - 10, )
+
+        if numpy is not None:
+            original = numpy.frombuffer(data, dtype=numpy.uint8).reshape(rows, rowlength)
+            up = numpy.zeros_like(original)
+            up[1:] = original[:-1]
+            left = numpy.zeros_like(original)
+            left[:, bpp:] = original[:, :-bpp]
+
+            candidates = []
+            for filterByte in filters:
                 if filterByte == 0:
-                    pass
+                    candidates.append(original)
                 elif filterByte == 1:
-                    # prior 
-                    bpp = (bits + 7) / 8
-                    for i in range(bpp+1, rowlength):
-                        rowdata[i] = (rowdata[i] + rowdata[i-1]) % 256
+                    candidates.append(original - left)
                 elif filterByte == 2:
-                    # up
-                    for i in range(1, rowlength):
-                        rowdata[i] = (rowdata[i] + prev_rowdata[i]) % 256
+                    candidates.append(original - up)
                 elif filterByte == 3:
-                    # average 
-                    bpp = (bits + 7) / 8
-                    for i in range(1, bpp):
-                        rowdata[i] = (rowdata[i] + prev_rowdata[i]/2) % 256
-                    for j in range(i, rowlength):
-                        rowdata[j] = (rowdata[j] + (rowdata[j-bpp] + prev_rowdata[j])/2) % 256
-                elif filterByte == 4:
-                    # paeth filtering 
-                    bpp = (bits + 7) / 8;
-                    for i in range(1, bpp):
-                        rowdata[i] = rowdata[i] + prev_rowdata[i];
-                    for j in range(i, rowlength):
-                        # fetch pixels 
-                        a = rowdata[j-bpp]
-                        b = prev_rowdata[j]
-                        c = prev_rowdata[j-bpp]
-
-                        # distances to surrounding pixels 
-                        pa = abs(b - c)
-                        pb = abs(a - c)
-                        pc = abs(a + b - 2*c)
-
-                        # pick predictor with the shortest distance 
-                        if pa <= pb and pa <= pc :  
-                            pred = a
-                        elif pb <= pc:
-                            pred = b
-                        else:
-                            pred = c
-                        rowdata[j] = rowdata[j] + pred
+                    candidates.append(original - ((left.astype(numpy.uint16) + up) >> 1).astype(numpy.uint8))
                 else:
-                    raise PDFSurgeDecoderException("Unsupported PNG filter {0}".format(filterByte))
+                    upleft = numpy.zeros_like(original)
+                    upleft[:, bpp:] = up[:, :-bpp]
+                    a, b, c = left.astype(numpy.int16), up.astype(numpy.int16), upleft.astype(numpy.int16)
+                    pa, pb, pc = numpy.abs(b - c), numpy.abs(a - c), numpy.abs(a + b - 2 * c)
+                    paeth = numpy.where((pa <= pb) & (pa <= pc), left, numpy.where(pb <= pc, up, upleft))
+                    candidates.append(original - paeth)
+
+            if len(candidates) == 1:
+                best = numpy.zeros(rows, dtype=numpy.intp)
+                encoded = candidates[0]
+            else:
+                table = numpy.frombuffer(_filter_costs, dtype=numpy.uint8)
+                costs = numpy.stack([table[candidate].sum(axis=1, dtype=numpy.int64) for candidate in candidates])
+                best = costs.argmin(axis=0)
+                encoded = numpy.stack(candidates)[best, numpy.arange(rows)]
+
+            filterBytes = numpy.array(filters, dtype=numpy.uint8)[best]
+            return numpy.hstack((filterBytes[:, None], encoded)).tobytes()
+
+        # Without NumPy, the data is handled as one integer whose bytes are subtracted at once (see _lanes_add)
+        size = len(data) * 8
+        high, low = _lanes_masks(size, 8)
+        original = int.from_bytes(data, 'big')
+        # Clears the first pixel of each row, that has no left neighbour
+        first = int.from_bytes((bytes(bpp) + b'\xff' * (rowlength - bpp)) * rows, 'big')
+        up = original >> (rowlength * 8)
+        left = (original >> (bpp * 8)) & first
+
+        candidates = []
+        for filterByte in filters:
+            if filterByte == 0:
+                candidates.append(data)
+                continue
+            elif filterByte == 1:
+                prediction = left
+            elif filterByte == 2:
+                prediction = up
+            elif filterByte == 3:
+                prediction = _lanes_average(left, up, high)
+            else:
+                upleft = (up >> (bpp * 8)) & first
+                prediction = int.from_bytes(bytes(map(_paeth,
+                    left.to_bytes(len(data), 'big'), up.to_bytes(len(data), 'big'), upleft.to_bytes(len(data), 'big'))), 'big')
+            candidates.append(_lanes_sub(original, prediction, high, low).to_bytes(len(data), 'big'))
 
-                return rowdata
+        output = bytearray()
+        for offset in range(0, len(data), rowlength):
+            best = 0
+            if len(candidates) > 1:
+                costs = [sum(candidate[offset:offset + rowlength].translate(_filter_costs)) for candidate in candidates]
+                best = costs.index(min(costs))
 
-        rowlength = columns + 1
-        assert len(decoded) % rowlength == 0
-        if predictor == 1 :
-            return decoded
+            output.append(filters[best])
+            output += candidates[best][offset:offset + rowlength]
 
-        output = BytesIO()
+        return bytes(output)
+
+    @classmethod
+    def _encode_tiff_rows(cls, data, rowlength, columns, colors, bits):
+        """ Applies the TIFF predictor 2 to complete rows, replacing each component by its difference with the previous pixel """
+        rows = len(data) // rowlength
+        if numpy is not None and bits >= 8:
+            dtype = numpy.dtype(numpy.uint8 if bits == 8 else '>u2')
+            samples = numpy.frombuffer(data, dtype=dtype).reshape(rows, columns, colors).astype(dtype.newbyteorder('='))
+            samples[:, 1:] -= samples[:, :-1].copy()
+            return samples.astype(dtype).tobytes()
+
+        padding = rowlength * 8 - columns * colors * bits
+        high, low = _lanes_masks(rowlength * 8, bits)
+        output = bytearray()
+        for offset in range(0, rows * rowlength, rowlength):
+            value = int.from_bytes(data[offset:offset + rowlength], 'big')
+            differences = _lanes_sub(value, value >> (colors * bits), high, low)
+            if padding:
+                differences = (differences >> padding << padding) | (value & ((1 << padding) - 1))
+            output += differences.to_bytes(rowlength, 'big')
+
+        return bytes(output)
+
+
+def _lanes_masks(size, width):
+    """
+    Returns the masks of the highest bit and of the other bits of each `width`-bit lane
+    of a `size`-bit integer, to do arithmetic on all the lanes at once.
+    """
+    if width >= 8:
+        pattern = (1 << (width - 1)).to_bytes(width // 8, 'big')
+    else:
+        pattern = bytes([sum(1 << (shift + width - 1) for shift in range(0, 8, width))])
+
+    high = int.from_bytes(pattern * (size // (len(pattern) * 8)), 'big')
+    return high, ((1 << size) - 1) ^ high
+
+
+def _lanes_add(a, b, high, low):
+    """ Adds each lane of `a` to the same lane of `b`, modulo 2**width: carries don't cross the lanes """
+    return ((a & low) + (b & low)) ^ ((a ^ b) & high)
+
+
+def _lanes_scan(value, size, distance, high, low):
+    """
+    Cumulative sum of the lanes of `value`, each lane being added to the one `distance` bits further
+    (the first lanes being the most significant ones). Done in log2(size / distance) additions.
+    """
+    while distance < size:
+        value = _lanes_add(value, value >> distance, high, low)
+        distance *= 2
+
+    return value
 
-        # PNG prediction can vary from row to row
-        prev_rowdata = (0,) * rowlength
-        for row in range(0, math.ceil(len(decoded) / rowlength)):
-            rowdata = decode_row([x for x in decoded[(row*rowlength):((row+1)*rowlength)]], prev_rowdata)
-            if predictor in [1,2]:
-                output.write(b''.join([bytes([x]) for x in rowdata[0:]]))
-            else:
-                output.write(b''.join([bytes([x]) for x in rowdata[1:]]))
-            prev_rowdata = rowdata
 
-        return output.getvalue()
+def _lanes_sub(a, b, high, low):
+    """ Subtracts each lane of `b` from the same lane of `a`, modulo 2**width: borrows don't cross the lanes """
+    return ((a | high) - (b & low)) ^ ((a ^ b) & high) ^ high
+
+
+def _lanes_average(a, b, high):
+    """ Average of each lane of `a` and of the same lane of `b`, rounded down, for 8-bit lanes """
+    return (a & b) + (((a ^ b) & ~(high >> 7)) >> 1)
+
+
+def _paeth(a, b, c):
+    """ PNG Paeth predictor of a byte, from its left (a), upper (b) and upper left (c) neighbours """
+    pa = abs(b - c)
+    pb = abs(a - c)
+    pc = abs(a + b - 2 * c)
+    if pa <= pb and pa <= pc:
+        return a
+    elif pb <= pc:
+        return b
+    return c
+
+
+# Absolute value of each byte seen as a signed value, to compare the PNG filters of a row
+_filter_costs = bytes(min(value, 256 - value) for value in range(256))
 
 
 class FlateDecoder(object):
@@ -529,36 +953,44 @@ class FlateDecoder(object):
         except Exception:
             raise PDFSurgeDecoderException('Error while decompressing the data in FlateDecoder.')
         
-        predictor = parameters.get('/Predictor', 1)
-        columns = parameters.get('/Columns', 1)
-        colors = parameters.get('/Colors', 1)
-        bits = parameters.get('/BitsPerComponent', 8)
-
-        if colors < 1:
-            colors = 1
-        
-        if bits not in [1, 2, 4, 8, 16]:
-            bits = 8
-        
+        predictor, columns, colors, bits = Predictor.parameters(parameters)
         if predictor != 1:
             return Predictor.decode(decoded, predictor, columns, colors, bits)
         
         return decoded
 
+    @classmethod
+    def iter_decode(cls, chunks, parameters, chunk_size=64 * 1024):
+        """ Decompresses the data given by chunks, yielding at most `chunk_size` bytes at a time """
+        predictor, columns, colors, bits = Predictor.parameters(parameters)
+        return Predictor.iter_decode(cls._iter_decompress(chunks, chunk_size), predictor, columns, colors, bits)
+
+    @classmethod
+    def _iter_decompress(cls, chunks, chunk_size):
+        decompressor = zlib.decompressobj()
+        try:
+            for chunk in chunks:
+                while chunk and not decompressor.eof:
+                    decoded = decompressor.decompress(chunk, chunk_size)
+                    chunk = decompressor.unconsumed_tail
+                    if decoded:
+                        yield decoded
+
+                if decompressor.eof:
+                    # Anything after the end of the compressed data is ignored
+                    return
+
+            decoded = decompressor.flush()
+        except zlib.error:
+            raise PDFSurgeDecoderException('Error while decompressing the data in FlateDecoder.')
+
+        if decoded:
+            yield decoded
+
     
     @classmethod
     def encode(cls, data, parameters):
-        predictor = parameters.get('/Predictor', 1)
-        columns = parameters.get('/Columns', 1)
-        colors = parameters.get('/Colors', 1)
-        bits = parameters.get('/BitsPerComponent', 8)
-
-        if colors < 1:
-            colors = 1
-        
-        if bits not in [1, 2, 4, 8, 16]:
-            bits = 8
-        
+        predictor, columns, colors, bits = Predictor.parameters(parameters)
         if predictor != 1:
             data = Predictor.encode(data, predictor, columns, colors, bits)
         
@@ -583,49 +1015,236 @@ class LZWDecoder(object):
     """
     @classmethod
     def decode(cls, data, parameters):
-        assert parameters.get('/EarlyChange', 1) == 1
-
-        decoded = None
-        try:
-            decoded = lzw.decompress(data)
-        except Exception:
-            raise PDFSurgeDecoderException('Error while decompressing the data in LZWDecoder.')
-
-        predictor = parameters.get('/Predictor', 1)
-        columns = parameters.get('/Columns', 1)
-        colors = parameters.get('/Colors', 1)
-        bits = parameters.get('/BitsPerComponent', 8)
-
-        if colors < 1:
-            colors = 1
-
-        if bits not in [1, 2, 4, 8, 16]:
-            bits = 8
+        decompressor = LZWDecompressor(parameters.get('/EarlyChange', 1))
+        decoded = decompressor.decompress(data)
 
+        predictor, columns, colors, bits = Predictor.parameters(parameters)
         if predictor != 1:
             return Predictor.decode(decoded, predictor, columns, colors, bits)
 
         return decoded
+
+    @classmethod
+    def iter_decode(cls, chunks, parameters, chunk_size=64 * 1024):
+        """ Decompresses the data given by chunks, yielding the data decoded from each chunk """
+        predictor, columns, colors, bits = Predictor.parameters(parameters)
+        return Predictor.iter_decode(cls._iter_decompress(chunks, parameters.get('/EarlyChange', 1)), predictor, columns, colors, bits)
+
+    @classmethod
+    def _iter_decompress(cls, chunks, early_change):
+        decompressor = LZWDecompressor(early_change)
+        for chunk in chunks:
+            decoded = decompressor.decompress(chunk)
+            if decoded:
+                yield decoded
+
+            if decompressor.eof:
+                return
     
     @classmethod
     def encode(cls, data, parameters):
-        assert parameters.get('/EarlyChange', 1) == 1
+        predictor, columns, colors, bits = Predictor.parameters(parameters)
+        if predictor != 1:
+            data = Predictor.encode(data, predictor, columns, colors, bits)
 
-        predictor = parameters.get('/Predictor', 1)
-        columns = parameters.get('/Columns', 1)
-        colors = parameters.get('/Colors', 1)
-        bits = parameters.get('/BitsPerComponent', 8)
+        compressor = LZWCompressor(parameters.get('/EarlyChange', 1))
+        return compressor.compress(data) + compressor.flush()
 
-        if colors < 1:
-            colors = 1
+    @classmethod
+    def iter_encode(cls, chunks, parameters):
+        """ Compresses the data given by chunks, yielding the data compressed from each chunk """
+        predictor, columns, colors, bits = Predictor.parameters(parameters)
+        compressor = LZWCompressor(parameters.get('/EarlyChange', 1))
+        for chunk in Predictor.iter_encode(chunks, predictor, columns, colors, bits):
+            encoded = compressor.compress(chunk)
+            if encoded:
+                yield encoded
 
-        if bits not in [1, 2, 4, 8, 16]:
-            bits = 8
+        yield compressor.flush()
 
-        if predictor != 1:
-            data = Predictor.encode(data, predictor, columns, colors, bits)
 
-        try:
-            return ''.join(lzw.compress(data))
-        except:
-            raise PDFSurgeDecoderException('Error while compressing the data in LZWDecoder.')
+class LZWDecompressor(object):
+    """
+    Incremental LZW decoder, fed with the compressed data by chunks (like zlib.decompressobj).
+
+    Codes are read MSB first from an integer accumulating the input bits, and looked up in
+    a table holding the bytes of each code: an entry is the entry of its prefix plus one byte,
+    so each code is decoded with a single lookup.
+    With /EarlyChange 1 (the default), codes get one bit wider one code before the table needs it.
+    """
+    max_width = 12
+
+    def __init__(self, early_change=1):
+        self.early_change = 1 if early_change else 0
+        self.eof = False
+
+        self._table = [bytes((i, )) for i in range(256)] + [b''] * ((1 << self.max_width) - 256)
+        self._bits = 0
+        self._count = 0
+        self._reset()
+
+    def _reset(self):
+        self._next = 258
+        self._width = 9
+        self._previous = None
+
+    def decompress(self, data):
+        """ Returns the bytes decoded from the given data, completing the code left incomplete by the previous call """
+        if self.eof:
+            return b''
+
+        table = self._table
+        early = self.early_change
+        size = len(table)
+        bits, count = self._bits, self._count
+        width, next_code, previous = self._width, self._next, self._previous
+
+        output = []
+        append = output.append
+        for byte in data:
+            bits = (bits << 8) | byte
+            count += 8
+            # Codes are at least 9 bits, so a byte completes at most one code
+            if count < width:
+                continue
+
+            count -= width
+            code = bits >> count
+            bits &= (1 << count) - 1
+
+            if code == 256:
+                # Clear table
+                width, next_code, previous = 9, 258, None
+                continue
+            elif code == 257:
+                # EOD
+                self.eof = True
+                break
+
+            if previous is None:
+                if code > 255:
+                    raise PDFSurgeDecoderException('Invalid code {0} in LZWDecoder.'.format(code))
+                entry = table[code]
+            else:
+                if code < next_code:
+                    entry = table[code]
+                    added = previous + entry[:1]
+                elif code == next_code:
+                    entry = added = previous + previous[:1]
+                else:
+                    raise PDFSurgeDecoderException('Invalid code {0} in LZWDecoder.'.format(code))
+
+                if next_code < size:
+                    table[next_code] = added
+                    next_code += 1
+                    if next_code + early >= (1 << width) and width < self.max_width:
+                        width += 1
+
+            append(entry)
+            previous = entry
+
+        self._bits, self._count = bits, count
+        self._width, self._next, self._previous = width, next_code, previous
+        return b''.join(output)
+
+
+class LZWCompressor(object):
+    """
+    Incremental LZW encoder, fed with the data by chunks (like zlib.compressobj), flush() ending the stream.
+
+    The table is a trie stored in a dict, mapping (code of a sequence << 8 | next byte) to the code
+    of the longer sequence, so the current sequence is only known by its code.
+    Codes are packed MSB first into an integer, written out as bytes once it holds a few of them.
+    A clear-table code is written when the table is full (4096 codes), and the widths of the codes
+    follow the same /EarlyChange rule as LZWDecompressor.
+    """
+    max_width = 12
+
+    def __init__(self, early_change=1):
+        self.early_change = 1 if early_change else 0
+
+        self._table = {}
+        self._prefix = None
+        self._bits = 0
+        self._count = 0
+        self._next = 258
+        self._width = 9
+        # The data starts with a clear-table code
+        self._write(256)
+
+    def _write(self, code):
+        self._bits = (self._bits << self._width) | code
+        self._count += self._width
+
+    def _output(self, flush=False):
+        count = self._count
+        if flush and count % 8:
+            # Pads the last byte with zeros
+            self._bits <<= 8 - count % 8
+            count += 8 - count % 8
+
+        size = count // 8
+        count -= size * 8
+        output = (self._bits >> count).to_bytes(size, 'big')
+        self._bits &= (1 << count) - 1
+        self._count = count
+        return output
+
+    def compress(self, data):
+        """ Returns the bytes compressed from the given data, the last sequence being kept until more data or flush() """
+        table = self._table
+        early = self.early_change
+        limit = 1 << self.max_width
+        prefix, bits, count = self._prefix, self._bits, self._count
+        width, next_code = self._width, self._next
+
+        output = bytearray()
+        for byte in data:
+            if prefix is None:
+                prefix = byte
+                continue
+
+            key = (prefix << 8) | byte
+            code = table.get(key)
+            if code is not None:
+                prefix = code
+                continue
+
+            bits = (bits << width) | prefix
+            count += width
+            prefix = byte
+
+            table[key] = next_code
+            next_code += 1
+            if next_code == limit:
+                # The table is full, it is cleared (the decoder reads the clear code with the widest codes)
+                bits = (bits << width) | 256
+                count += width
+                table.clear()
+                next_code, width = 258, 9
+            elif next_code - 1 + early >= (1 << width) and width < self.max_width:
+                # The decoder adds each entry one code later than here
+                width += 1
+
+            if count >= 256:
+                size = count // 8
+                count -= size * 8
+                output += (bits >> count).to_bytes(size, 'big')
+                bits &= (1 << count) - 1
+
+        self._prefix, self._bits, self._count = prefix, bits, count
+        self._width, self._next = width, next_code
+        output += self._output()
+        return bytes(output)
+
+    def flush(self):
+        """ Writes the last sequence and the EOD code, and returns the remaining bytes """
+        if self._prefix is not None:
+            self._write(self._prefix)
+            self._prefix = None
+            # The decoder adds an entry when it reads the last sequence
+            if self._next + self.early_change >= (1 << self._width) and self._width < self.max_width:
+                self._width += 1
+
+        self._write(257)
+        return self._output(flush=True)
@@ -5,6 +5,8 @@ __author_email__ = "cyril@pdfshift.io"
 
 layouts = ('/NoLayout', '/SinglePage', '/OneColumn', '/TwoColumnLeft', '/TwoColumnRight', '/TwoPageLeft', '/TwoPageRight')
 pagemodes = ('/UseNone', '/UseOutlines', '/UseThumbs', '/FullScreen', '/UseOC', '/UseAttachments')
+# Attributes of the pages inherited from the nodes of the page tree (PDF spec table 30)
+inheritable = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
 
 escaped_dict = {
     b'n': b'\n',
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+__author__ = "Cyril Nicodeme"
+__author_email__ = "cyril@pdfshift.io"
+
+from hashlib import blake2b
+import marshal, os, random, struct, tempfile, time
+
+
+class IndexCache:
+    """
+    On-disk cache of the cross-reference index of documents, so opening the same
+    document again skips reading its xref sections.
+
+    Each document is stored in its own file in `directory`, named after a key made
+    of the size of the document, its modification time and a hash of its last bytes.
+    A modified document gets a new key: its previous entry is never read again and
+    is removed along with the least recently used ones once the entries take more
+    than `max_bytes` on disk. As listing the directory costs a system call per entry,
+    this is only checked when the entries stored by this instance may exceed the
+    limit, and once every `prune_interval` stores on average (the directory may be
+    shared by several processes).
+    Loading an entry marks it as recently used, at most once per `touch_interval` seconds.
+
+    Entries are a small header (with a digest of the content) followed by the index,
+    the trailer and, once they were read, the references of the pages, serialized with
+    marshal. As marshal isn't meant to read untrusted data, only entries owned by the
+    current user and not writable by others are read, once their digest is checked.
+    Unreadable, outdated or modified entries are considered as missing.
+    """
+    suffix = '.idx'
+    magic = b'PSIX'
+    version = 3
+    prune_interval = 64
+    touch_interval = 3600
+
+    _header = struct.Struct('<4sBB20s')
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Bytes stored by this instance since the last pruning, an upper bound when entries are replaced
+        self._stored_bytes = 0
+        self._stores = random.randrange(self.prune_interval)
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            # The cache is optional, storing entries will fail silently
+            pass
+
+    @staticmethod
+    def key(size, mtime, tail):
+        """ Returns the key of a document from its size, its modification time (or 0) and its last bytes """
+        digest = blake2b(digest_size=20)
+        digest.update(struct.pack('<QQ', size, mtime))
+        digest.update(tail)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    @staticmethod
+    def _digest(content):
+        return blake2b(content, digest_size=20).digest()
+
+    def load(self, key):
+        """ Returns the state stored for the given key, or None """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if hasattr(os, 'getuid') and (stat.st_uid != os.getuid() or stat.st_mode & 0o022):
+                    # Could have been written by someone else
+                    return None
+                data = f.read()
+        except OSError:
+            return None
+
+        try:
+            magic, version, marshal_version, digest = self._header.unpack_from(data)
+            if magic != self.magic or version != self.version or marshal_version != marshal.version:
+                raise ValueError('Outdated entry')
+
+            content = data[self._header.size:]
+            if digest != self._digest(content):
+                raise ValueError('Damaged entry')
+
+            stored_key, state = marshal.loads(content)
+            if stored_key != key or not isinstance(state, dict):
+                raise ValueError('Invalid entry')
+        except (ValueError, EOFError, TypeError, struct.error):
+            self.invalidate(key)
+            return None
+
+        if time.time_ns() - stat.st_mtime_ns > self.touch_interval * 1000000000:
+            try:
+                # Keeps the most recently used entries when pruning
+                os.utime(path)
+            except OSError:
+                pass
+
+        return state
+
+    def store(self, key, state):
+        """
+        Stores the state (a dict of marshallable values) of the given key.
+        Entries are written to a temporary file first, so concurrent readers never see a partial entry.
+        """
+        try:
+            content = marshal.dumps((key, state))
+        except ValueError:
+            # The trailer holds values that can't be serialized, the document is not cached
+            return False
+
+        data = self._header.pack(self.magic, self.version, marshal.version, self._digest(content)) + content
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            return False
+
+        try:
+            descriptor, temporary = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        except OSError:
+            # Missing or read-only directory
+            return False
+
+        try:
+            with os.fdopen(descriptor, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, self._path(key))
+        except OSError:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            return False
+
+        self._stored_bytes += len(data)
+        self._stores += 1
+        if self._stores % self.prune_interval == 0 or (
+            self.max_bytes is not None and self._stored_bytes > self.max_bytes
+        ):
+            try:
+                self._prune()
+            except OSError:
+                pass
+        return True
+
+    def invalidate(self, key):
+        """ Removes the entry of the given key, if any """
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        """ Removes every entry """
+        for entry in self._entries():
+            self.invalidate(entry.name[:-len(self.suffix)])
+
+    def _entries(self):
+        try:
+            with os.scandir(self.directory) as it:
+                return [entry for entry in it if entry.name.endswith(self.suffix) and entry.is_file()]
+        except OSError:
+            return []
+
+    def _prune(self):
+        """
+        Removes the least recently used entries once they take more than `max_bytes`,
+        down to three quarters of it, so the following stores don't prune again right away.
+        """
+        if self.max_bytes is None:
+            return
+
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.name))
+
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes if total <= self.max_bytes else self.max_bytes * 3 // 4
+        for _, size, name in sorted(entries):
+            if total <= target:
+                break
+
+            self.invalidate(name[:-len(self.suffix)])
+            total -= size
+
+        # Checked again once this instance alone could have filled the room left
+        self._stored_bytes = total
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+__author__ = "Cyril Nicodeme"
+__author_email__ = "cyril@pdfshift.io"
+
+from .exceptions import PDFParserException
+from .defines import escaped_dict
+from datetime import datetime
+import re
+
+
+# Tokens kinds
+NUMBER = 1
+REFERENCE = 2
+NAME = 3
+STRING = 4
+HEXSTRING = 5
+BOOLEAN = 6
+NULL = 7
+ARRAY_START = 8
+ARRAY_END = 9
+DICT_START = 10
+DICT_END = 11
+KEYWORD = 12  # R, obj, endobj, stream, endstream, ...
+EOF = 13
+
+_ws = rb'\x00\t\n\x0c\r '
+_delimiters = rb'()<>\[\]{}/%'
+_regular = rb'[^' + _ws + _delimiters + rb']'
+
+_re_token = re.compile(
+    rb'(?:[' + _ws + rb']|%[^\r\n%]*)*'  # Whitespaces and comments
+    rb'(?:'
+    rb'(?P<reference>(?P<refnum>\d+)[' + _ws + rb']+(?P<refgen>\d+)[' + _ws + rb']+R(?!' + _regular + rb'))'
+    rb'|(?P<number>[+-]?(?:\d+\.?\d*|\.\d+))'
+    rb'|(?P<name>/' + _regular + rb'*)'
+    rb'|(?P<dict_start><<)'
+    rb'|(?P<dict_end>>>)'
+    rb'|(?P<hexstring><[^>]*>)'
+    rb'|(?P<string>\()'
+    rb'|(?P<array_start>\[)'
+    rb'|(?P<array_end>\])'
+    rb'|(?P<keyword>' + _regular + rb'+|[{}])'
+    rb')'
+)
+_re_string_special = re.compile(rb'[()\\]')
+_re_string_escape = re.compile(rb'\\([0-7]{1,3}|\r\n|[\s\S])')
+_re_name_escape = re.compile(rb'#([0-9A-Fa-f]{2})')
+_re_spaces = re.compile(rb'[' + _ws + rb']+')
+
+_keywords = {
+    b'true': (BOOLEAN, True),
+    b'false': (BOOLEAN, False),
+    b'null': (NULL, None)
+}
+
+
+class Truncated(Exception):
+    """
+    Raised when a token reaches the end of a buffer that is not the end of the document.
+    The caller is expected to retry with a larger buffer.
+    """
+    pass
+
+
+def decode_name(raw):
+    """ Returns the name as a string starting with "/", with its #xx escapes decoded """
+    if b'#' in raw:
+        raw = _re_name_escape.sub(lambda match: bytes((int(match.group(1), base=16), )), raw)
+
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return raw.decode('latin-1')
+
+
+def decode_number(raw):
+    """ Returns either an int or a float """
+    if b'.' in raw:
+        return float(raw)
+
+    return int(raw)
+
+
+def _unescape(match):
+    value = match.group(1)
+    if value[0] in b'01234567':
+        # "The number ddd may consist of one, two, or three
+        # octal digits; high-order overflow shall be ignored."
+        # (PDF reference 7.3.4.2, p 16)
+        return bytes((int(value, base=8) & 0xff, ))
+    if value in (b'\r\n', b'\r', b'\n'):
+        # When the string is written on multiline.
+        return b''
+
+    return escaped_dict.get(value, value)
+
+
+def decode_string(raw):
+    """ Returns the content of a literal string (without its parenthesis), or a datetime for dates """
+    if b'\\' in raw:
+        raw = _re_string_escape.sub(_unescape, raw)
+
+    if raw[0:2] == b'D:':
+        value = raw[2:].replace(b"'", b'').replace(b'Z', b'')
+        if len(value) == 14:
+            value += b'+0000'
+        try:
+            return datetime.strptime(value.decode('utf-8'), "%Y%m%d%H%M%S%z")
+        except (ValueError, UnicodeDecodeError):
+            pass
+
+    return raw
+
+
+def decode_hexstring(raw):
+    """ Returns the content of an hexadecimal string (without its brackets) """
+    raw = _re_spaces.sub(b'', raw)
+    if len(raw) % 2 != 0:
+        raw += b'0'
+
+    try:
+        return bytes.fromhex(raw.decode('ascii'))
+    except (ValueError, UnicodeDecodeError):
+        raise PDFParserException('Invalid Hexadecimal value given.')
+
+
+class Lexer:
+    """
+    Splits the content of a buffer (bytes, bytearray, mmap, ...) into typed tokens,
+    starting at `position` and stopping at `end`.
+
+    Each call to next() returns a (kind, value) tuple where value is already converted
+    (int/float for NUMBER, (idnum, generation) for REFERENCE, str for NAME, bytes for
+    strings, the raw bytes for KEYWORD). The "idnum generation R" sequences are matched
+    as a single REFERENCE token, so numbers never need to be read twice.
+
+    When `eof` is False, the buffer is a window over a larger document and Truncated is
+    raised whenever a token might continue past `end`.
+    """
+    # Enough to tell if a number is followed by "generation R"
+    lookahead = 32
+
+    def __init__(self, buffer, position=0, end=None, eof=True):
+        self.buffer = buffer
+        self.position = position
+        self.end = len(buffer) if end is None else end
+        self.eof = eof
+
+    def next(self):
+        match = _re_token.match(self.buffer, self.position, self.end)
+        if match is None:
+            if not self.eof:
+                raise Truncated()
+            # Only whitespaces and comments until the end
+            self.position = self.end
+            return EOF, None
+
+        end = match.end()
+        if not self.eof and end + self.lookahead > self.end:
+            raise Truncated()
+
+        kind = match.lastgroup
+        if kind == 'reference':
+            token = (REFERENCE, (int(match.group('refnum')), int(match.group('refgen'))))
+        elif kind == 'number':
+            token = (NUMBER, decode_number(match.group(kind)))
+        elif kind == 'name':
+            token = (NAME, decode_name(match.group(kind)))
+        elif kind == 'dict_start':
+            token = (DICT_START, None)
+        elif kind == 'dict_end':
+            token = (DICT_END, None)
+        elif kind == 'array_start':
+            token = (ARRAY_START, None)
+        elif kind == 'array_end':
+            token = (ARRAY_END, None)
+        elif kind == 'string':
+            end = self._string_end(end)
+            token = (STRING, decode_string(bytes(self.buffer[match.end():end - 1])))
+        elif kind == 'hexstring':
+            token = (HEXSTRING, decode_hexstring(bytes(match.group(kind)[1:-1])))
+        else:
+            value = bytes(match.group(kind))
+            token = _keywords.get(value, (KEYWORD, value))
+
+        self.position = end
+        return token
+
+    def _string_end(self, position):
+        """ Returns the position following the parenthesis closing the literal string. """
+        level = 1  # 1 because we already are inside the first "("
+        while True:
+            match = _re_string_special.search(self.buffer, position, self.end)
+            if match is None:
+                if not self.eof:
+                    raise Truncated()
+                raise PDFParserException('Unterminated literal string.')
+
+            char = self.buffer[match.start()]
+            position = match.end()
+            if char == 0x5c:  # \
+                position += 1  # Escaped character
+            elif char == 0x28:  # (
+                level += 1
+            else:
+                level -= 1
+                if level == 0:
+                    return position
@@ -1,85 +1,218 @@
 # -*- coding: utf-8 -*-
-from .exceptions import PDFParserException, PDFSurgeStreamError
-from .defines import escaped_dict
+from .exceptions import PDFSurgeException, PDFParserException, PDFSurgeStreamError
 from .decoders import Filters
+from .stream import StreamReader
+from .lexer import (
+    Lexer, Truncated, ARRAY_START, ARRAY_END, DICT_START, DICT_END, KEYWORD, EOF
+)
 from datetime import datetime
-import io, re, codecs
+import io, re
 
 __author__ = "Cyril Nicodeme"
 __author_email__ = "cyril@pdfshift.io"
 
 
 
+_re_integer = re.compile(rb'\d+')
+
+
 def parse_stream(reader, jump=False):
-    if not jump:
-        reader.read_until_char()
-
-    tok = reader.peek(1).lower()
-    if tok in parsers_objects:
-        return parsers_objects[tok].parse(reader)
-    elif tok == b'>':
-        assert reader.read(2) == b'>>'
-        raise PDFParserException('Unexpected end of object.')
-    elif tok == b'%':
-        # Comment
-        reader.readline()
-    elif tok == b'<':
-        if reader.peek(2) == b'<<':
-            return DictionaryObject.parse(reader)
-        else:
-            return StringObject.parse_hex(reader)
-    else:
-        indirect = IndirectObject.parse(reader)
-        if indirect:
-            return indirect
+    """
+    Parses the value at the current position of the reader, and moves the reader after it.
+
+    The value is read through a Lexer over a window of the reader, growing the window
+    when the value doesn't fit in it. Arrays and dictionaries are built iteratively,
+    so deeply nested values are not limited by the recursion depth.
+    """
+    length = 1024
+    while True:
+        buffer, offset, end, eof = reader.window(length)
+        lexer = Lexer(buffer, offset, end, eof)
+        try:
+            value = build_object(lexer)
+        except Truncated:
+            length *= 4
+            continue
+
+        reader.seek(lexer.position - offset, io.SEEK_CUR)
+        return value
 
-        return NumericObject.parse(reader)
-    
-    raise PDFParserException('Unable to parse the given value.')
+
+def build_object(lexer):
+    """ Builds the next object from the tokens of the given Lexer """
+    stack = []
+    while True:
+        kind, value = lexer.next()
+        if kind == ARRAY_START or kind == DICT_START:
+            stack.append((kind, []))
+            continue
+        elif kind == ARRAY_END:
+            if not stack or stack[-1][0] != ARRAY_START:
+                raise PDFParserException('Unexpected end of array.')
+            value = stack.pop()[1]
+        elif kind == DICT_END:
+            if not stack or stack[-1][0] != DICT_START:
+                raise PDFParserException('Unexpected end of object.')
+            items = stack.pop()[1]
+            if len(items) % 2 != 0:
+                raise PDFParserException('Missing value in dictionary.')
+            value = dict(zip(items[0::2], items[1::2]))
+        elif kind == KEYWORD:
+            raise PDFParserException('Unexpected keyword "{0}".'.format(value.decode('latin-1')))
+        elif kind == EOF:
+            raise PDFSurgeStreamError('Unexpected end of stream')
+
+        if not stack:
+            return value
+
+        stack[-1][1].append(value)
 
 
 class Parser:
     """ Root class for the various PDF Objects """
+    types = ()
+
     @classmethod
     def parse(cls, reader):
-        raise NotImplementedError()
+        position = reader.tell()
+        value = parse_stream(reader)
+        if not isinstance(value, cls.types):
+            reader.seek(position, io.SEEK_SET)
+            raise PDFParserException('Unexpected value. Expected {0}.'.format(cls.__name__))
+
+        return value
 
 
 class PDFObject(Parser):
     def __init__(self):
         self.properties = {}
-        self.stream = None
         self.data = None
+        # The value of the object. For dictionaries (and streams), the same dict as properties
+        self.value = self.properties
+        self._stream = None
+        # (reader, offset, length) of a stream content that was not read yet
+        self._location = None
+
+    @property
+    def stream(self):
+        if self._stream is None and self._location is not None:
+            reader, offset, length = self._location
+            # The object may be accessed from another thread than the one that parsed it
+            self._stream = reader.cursor().view(offset, length)
+            self._location = None
+
+        return self._stream
+
+    @stream.setter
+    def stream(self, value):
+        self._stream = value
+        self._location = None
+
+    def memory_size(self):
+        """ Returns the number of bytes held by the stream content and its decoded data, once loaded """
+        size = 0
+        if self._stream is not None:
+            size += len(self._stream)
+        if self.data is not None and self.data is not self._stream:
+            size += len(self.data)
+
+        return size
 
     def get_data(self):
         if not self.data:
-            filters = self.properties.get('/Filter', None)
-            if filters:
-                if isinstance(filters, str):
-                    filters = (filters, )
-
-                self.data = self.stream
-                for filter in filters:
-                    self.data = Filters.decode(self.data, filter, self.properties.get('/DecodeParms', {}))
+            # Decoded before being set, as other threads may read it meanwhile
+            data = self.stream
+            for filter, parameters in self._get_filters():
+                data = Filters.decode(data, filter, parameters)
+
+            self.data = data
                 
         return self.data
 
-    @classmethod
-    def parse(cls, reader, endobj=True):
-        reader.read_until_char()
-        assert reader.peek(2) == b'<<'
+    def iter_data(self, chunk_size=64 * 1024):
+        """
+        Yields the decoded data by chunks of about `chunk_size` bytes.
+        The content is read and decoded chunk by chunk through the filters, and neither is kept,
+        so large streams (images, ...) are processed in constant memory. Once get_data() was
+        called, the decoded data is yielded instead.
+        """
+        if self.data:
+            data = memoryview(self.data)
+            for offset in range(0, len(data), chunk_size):
+                yield bytes(data[offset:offset + chunk_size])
+            return
+
+        chunks = self._iter_stream(chunk_size)
+        for filter, parameters in self._get_filters():
+            chunks = Filters.iter_decode(chunks, filter, parameters, chunk_size)
+
+        for chunk in chunks:
+            if chunk:
+                yield bytes(chunk)
+
+    def _iter_stream(self, chunk_size):
+        """ Yields the content of the stream by chunks, without loading it when it was not read yet """
+        location = self._location
+        if location is not None:
+            reader, offset, length = location
+            reader = reader.cursor()
+        else:
+            reader, offset, length = None, 0, len(self.stream or b'')
+
+        for position in range(offset, offset + length, chunk_size):
+            size = min(chunk_size, offset + length - position)
+            if reader is not None:
+                yield reader.view(position, size)
+            else:
+                yield self.stream[position:position + size]
 
+    def _get_filters(self):
+        """ Returns the (filter, parameters) pairs to apply to the stream, in order """
+        filters = self.properties.get('/Filter', None)
+        if not filters:
+            return []
+
+        parameters = self.properties.get('/DecodeParms', None) or {}
+        if isinstance(filters, str):
+            filters = (filters, )
+
+        if isinstance(parameters, list):
+            # One entry per filter, null when the filter has no parameters
+            return [(filter, parameters[i] if i < len(parameters) and isinstance(parameters[i], dict) else {}) for i, filter in enumerate(filters)]
+
+        return [(filter, parameters) for filter in filters]
+
+    @classmethod
+    def parse(cls, reader, endobj=True, resolve=None, lazy=False):
+        """
+        Parses an object, the reader being right after its "obj" keyword.
+
+        `resolve` is called to get the value of an indirect /Length.
+        When `lazy` is True, the content of a stream is not read: its offset and length
+        are recorded, and it is fetched when .stream (or get_data()) is first accessed.
+        """
         obj = cls()
-        obj.properties = parse_stream(reader)
-        
+        obj.value = parse_stream(reader)
+        if not isinstance(obj.value, dict):
+            # Numbers, arrays, ... can't have a stream
+            if endobj:
+                reader.read_until_char()
+                assert reader.read(6) == b'endobj'
+            return obj
+
+        obj.properties = obj.value
         try:
             reader.read_until_char()
             peek = reader.peek(6)
             if peek == b'stream':
                 # Stream
                 reader.read(6)
-                obj.stream = reader.read_until(b'endstream').strip()
-                reader.read(9)
+                start, stop = cls._locate_stream(reader, obj.properties, resolve)
+                if lazy:
+                    obj._location = (reader, start, stop - start)
+                else:
+                    # A memoryview over in-memory buffers (mmap, bytes, ...), not a copy
+                    obj.stream = reader.view(start, stop - start)
                 reader.read_until_char()
 
             if endobj:
@@ -89,117 +222,138 @@ class PDFObject(Parser):
 
         return obj
 
-
-class ArrayObject(Parser):
     @classmethod
-    def parse(cls, reader):
-        """ Returns a list """
-        result = []
-    
-        assert reader.read(1) == b'['
-        while True:
-            if reader.peek(1) == b']':
-                reader.seek(1, io.SEEK_CUR) # We pass the "]" char
-                break
+    def _locate_stream(cls, reader, properties, resolve=None):
+        """
+        Returns the (start, end) positions of the content of a stream, the reader being
+        right after the "stream" keyword, and moves the reader after "endstream".
+
+        The /Length of the stream (resolved through `resolve` when indirect) is trusted
+        when "endstream" is found right after it. Otherwise, "endstream" is searched for.
+        """
+        # The keyword is followed by an end of line: CRLF or LF (a lone CR is tolerated)
+        if reader.peek(1) == b'\r':
+            reader.read(1)
+        if reader.peek(1) == b'\n':
+            reader.read(1)
+        start = reader.tell()
+
+        length = properties.get('/Length')
+        if isinstance(length, tuple) and resolve is not None:
+            try:
+                length = resolve(length)
+            except PDFSurgeException:
+                length = None
+            reader.seek(start, io.SEEK_SET)
+
+        if isinstance(length, int) and length >= 0:
+            try:
+                reader.seek(start + length, io.SEEK_SET)
+                reader.read_until_char()
+                if reader.peek(9) == b'endstream':
+                    reader.read(9)
+                    return start, start + length
+            except PDFSurgeStreamError:
+                pass
+
+        # Broken (or missing) /Length, the end of line before "endstream" is not part of the content
+        end = reader.find(b'endstream', start)
+        if end < 0:
+            raise PDFParserException('Stream without "endstream" keyword.')
+
+        reader.seek(end + 9, io.SEEK_SET)
+        stop = end
+        if stop > start and reader.view(stop - 1, 1) == b'\n':
+            stop -= 1
+        if stop > start and reader.view(stop - 1, 1) == b'\r':
+            stop -= 1
+
+        return start, stop
+
+
+class ObjectStream:
+    """
+    Decoded content of an object stream (/ObjStm), decoded once.
+    Its header ("num offset" pairs) is turned into a {num: offset} table.
+    """
+    def __init__(self, obj):
+        if obj.properties.get('/Type') != '/ObjStm':
+            raise PDFParserException('Expected an /ObjStm, got {0}.'.format(obj.properties.get('/Type')))
+
+        data = obj.get_data()
+        first = obj.properties.get('/First')
+        count = obj.properties.get('/N')
+
+        header = [int(x) for x in _re_integer.findall(bytes(data[:first]))]
+        if len(header) < count * 2:
+            raise PDFParserException('Invalid /ObjStm header.')
+
+        self.reader = StreamReader(data)
+        self.numbers = header[0:count * 2:2]
+        self.offsets = dict(zip(self.numbers, (first + offset for offset in header[1:count * 2:2])))
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def memory_size(self):
+        return len(self.reader)
+
+    def __contains__(self, num):
+        return num in self.offsets
+
+    def get(self, num):
+        """ Parses the object with the given number """
+        # A cursor of its own, as objects can be loaded from several threads
+        reader = self.reader.cursor()
+        reader.seek(self.offsets[num], io.SEEK_SET)
+        return PDFObject.parse(reader, endobj=False)
+
+    def items(self):
+        """ Parses every object of the stream, in one sweep, yielding (index, num, object) """
+        for index, num in enumerate(self.numbers):
+            yield index, num, self.get(num)
 
-            result.append(parse_stream(reader))
 
-        return result
+class ArrayObject(Parser):
+    """ Returns a list """
+    types = (list, )
 
 
 class BooleanObject(Parser):
-    @classmethod
-    def parse(cls, reader):
-        """ Returns a bool """
-        value = reader.read(4).lower()
-        if value == b'true':
-            return True
-        elif value == b'fals':
-            reader.seek(1, io.SEEK_CUR) # We pass the "e" char from falsE
-            return False
-        
-        raise PDFParserException('Unexpected value. Expected Boolean Object.')
+    """ Returns a bool """
+    types = (bool, )
 
-class DictionaryObject(Parser):
-    @classmethod
-    def parse(cls, reader):
-        assert reader.read(2) == b'<<'
-
-        result = {}
-        while True:
-            reader.read_until_char()
-            if reader.peek(2) == b'>>':
-                reader.read(2)
-                break
 
-            key = parse_stream(reader, jump=True)
-            value = parse_stream(reader)
-            result[key] = value
-
-        return result
+class DictionaryObject(Parser):
+    """ Returns a dict """
+    types = (dict, )
 
 
 class IndirectObject(Parser):
+    """ Returns a tuple of two values: (idnum, generation) """
+    types = (tuple, )
+
     @classmethod
     def parse(cls, reader):
-        """ Returns a tuple of two values: (idnum, generation) """
-        position = reader.tell()
-        idnum = reader.read_until_space()
-        generation = reader.read_until_space()
-        r = reader.read(1)
-
         try:
-            assert r == b'R'
-            return (int(idnum), int(generation))
-        except (AssertionError, ValueError):
-            reader.seek(position, io.SEEK_SET)
+            return super().parse(reader)
+        except (PDFParserException, PDFSurgeStreamError):
             return None
 
 
 class NameObject(Parser):
-    @classmethod
-    def parse(cls, reader):
-        """ Returns a string starting with "/" """
-        assert reader.read(1) == b'/'
-        value = reader.read_until((b' ', b'[', b'(', b'<', b'{', b'%', b'>', b'/', b']', b')', b'}'), ignore_eof=True)
-        return '/{0}'.format(value.decode('utf-8'))
+    """ Returns a string starting with "/" """
+    types = (str, )
 
 
 class NullObject(Parser):
-    @classmethod
-    def parse(cls, reader):
-        """ Returns none """
-        value = reader.read(4)
-        if value.lower() != b'null':
-            raise PDFParserException('Unexpected value. Expected Null Object.')
-        
-        return None
+    """ Returns none """
+    types = (type(None), )
 
 
 class NumericObject(Parser):
     """ Returns either an int or a float """
-    signs = {b'+': 1, b'-': -1}
-
-    @classmethod
-    def parse(cls, reader):
-        value = b''
-        while True:
-            tok = reader.read(1)
-            if tok in b'+-.0123456789':
-                value += tok
-            else:
-                reader.seek(-1, io.SEEK_CUR)
-                break
-
-        multiplier = 1
-        if value[0:1] in (b'+', b'-'):
-            multiplier = cls.signs[value[0:1]]
-            value = value[1:]
-
-        if value.find(b'.') > -1:
-            return float(value) * multiplier
-        else:
-            return int(value) * multiplier
+    types = (int, float)
 
 
 # @see https://github.com/feliam/miniPDF/blob/4d7b34c74b34838f43f61f64afe76f91899dba27/minipdf/minipdf.py
@@ -223,79 +377,12 @@ class PDFString(bytes):
 
 
 class StringObject(Parser):
-    @classmethod
-    def parse_hex(cls, reader):
-        """ Returns a str """
-        assert reader.read(1) == b'<'
-
-        value = reader.read_until(b'>') # Set hexadecimal !
-        if len(value) == 1:
-            value += '0'
-        if len(value) % 2 != 0:
-            raise PDFParserException('Invalid Hexadecimal value given.')
-
-        reader.read(1)
-
-        chunks = [value[i:i+2] for i in range(0, len(value), 2)]
-        value = ''.join([chr(int(c, base=16)) for c in chunks]).encode('utf-8')
+    """ Returns the bytes of a literal or hexadecimal string, or a datetime for dates """
+    types = (bytes, datetime)
 
-        if value != b'':
-            value = re.sub(b'\\\\[0-9]{1,3}', cls.decode_8bit, value)
-        
-        return value
-    
     @classmethod
-    def parse(cls, reader):
-        """ Returns a str """
-        assert reader.read(1) == b'('
-        level = 1  # 1 because we already are inside the first "("
-        value = b''
-
-        while True:
-            tok = reader.read(1)
-            if tok == b'(':
-                level += 1
-            elif tok == b')':
-                level -= 1
-                if level == 0:
-                    break
-            elif tok == b'\\':
-                tok = reader.read(1)
-                if tok in escaped_dict:
-                    tok = escaped_dict[tok]
-                elif tok.isdigit():
-                    # "The number ddd may consist of one, two, or three
-                    # octal digits; high-order overflow shall be ignored.
-                    # Three octal digits shall be used, with leading zeros
-                    # as needed, if the next character of the string is also
-                    # a digit." (PDF reference 7.3.4.2, p 16)
-                    for i in range(2):
-                        subtok = reader.read(1)
-                        if not subtok.isdigit():
-                            break
-                        tok += subtok
-                    
-                    tok = bytes(int(tok, base=8))
-                    # TODO: value.set_utf16(True)
-                elif tok in b'\n\r':
-                    # When the string is written on multiline.
-                    if reader.read(1) not in b'\n\r':
-                        reader.seek(-1, io.SEEK_CUR)
-                    
-                    # We don't add a breakline since it's not escaped
-                    continue
-
-            value += tok
-
-        if value:
-            if value[0:2] == b'D:':
-                value = value[2:].replace(b"'", b'')
-                value = value.replace(b'Z', b'')
-                if len(value) == 14:
-                    value += b'+0000'
-                return datetime.strptime(value.decode('utf-8'), "%Y%m%d%H%M%S%z")
-
-        return value
+    def parse_hex(cls, reader):
+        return cls.parse(reader)
 
     @classmethod
     def decode_8bit(cls, match):
@@ -303,13 +390,3 @@ class StringObject(Parser):
         if value == b'000':
             return b''
         return bytes(int(value, base=8))
-
-
-parsers_objects = {
-    b'/': NameObject,
-    b'[': ArrayObject,
-    b't': BooleanObject,
-    b'f': BooleanObject,
-    b'(': StringObject,
-    b'n': NullObject
-}
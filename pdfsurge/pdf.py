@@ -3,26 +3,223 @@
 __author__ = "Cyril Nicodeme"
 __author_email__ = "cyril@pdfshift.io"
 
-from .exceptions import PDFSurgeException
+from .exceptions import PDFSurgeException, PDFSurgeStreamError
 from .stream import StreamReader
-from .objects import PDFObject, parse_stream
-from .defines import layouts, pagemodes
-from io import BytesIO
-import io, zlib, struct
+from .objects import PDFObject, ObjectStream, parse_stream
+from .defines import layouts, pagemodes, inheritable
+from .cache import ObjectCache
+from .xref import XrefIndex, decode_xref_stream, decode_xref_entry, scan_objects, FREE, IN_USE, COMPRESSED
+from mmap import mmap as MappedFile, ACCESS_READ
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque, namedtuple
+from itertools import islice
+from types import MappingProxyType
+import copy, io, os, re, tempfile, threading, time, zlib
+
+
+# A classic xref entry: "nnnnnnnnnn ggggg n" followed by a 2 bytes end of line
+_re_xref_entry = re.compile(rb'(\d{10}) (\d{5}) ([fn])(?: \r| \n|\r\n)')
+# Also matches the entries of non-conforming tables, ending with a single end of line character
+_re_xref_entry_loose = re.compile(rb'(\d{10}) (\d{5}) ([fn])(?: \r| \n|\r\n|\r|\n)')
+_re_startxref = re.compile(rb'startxref\s+(\d+)')
+
+# Result of PDFSurge.probe. The metadata is a read-only dict.
+PDFProbe = namedtuple('PDFProbe', ('version', 'page_count', 'encrypted', 'metadata', 'xref_sections'))
 
 
 class PDFSurge:
     @classmethod
     def read_from_file(cls, path):
-        return cls(open(path, 'rb'))
+        return cls.open(path)
+
+    @classmethod
+    def open(cls, path, mmap=False, **options):
+        """
+        Opens the PDF document at the given path.
+
+        When `mmap` is True, the file is memory-mapped and parsed in place:
+        stream contents are memoryview slices of the mapping, not copies.
+        Other options are given to the constructor.
+        The returned instance owns the file and can be used as a context manager:
+
+            with PDFSurge.open(path, mmap=True) as pdf:
+                ...
+        """
+        stream = open(path, 'rb')
+        source = stream
+        try:
+            # Taken from the file, as mappings don't tell it (see index_cache)
+            options.setdefault('mtime', os.fstat(stream.fileno()).st_mtime_ns)
+            if mmap:
+                try:
+                    source = MappedFile(stream.fileno(), 0, access=ACCESS_READ)
+                except ValueError:
+                    # Empty files can't be mapped, the header check will fail below
+                    source = stream
+                else:
+                    # The mapping keeps its own handle on the file
+                    stream.close()
+            else:
+                source = stream
+
+            pdf = cls(source, **options)
+        except Exception:
+            stream.close()
+            cls._release(source)
+            raise
+
+        pdf._resources.append(source)
+        pdf._source = (path, mmap)
+        return pdf
+
+    @classmethod
+    def from_stream(cls, readable, spool_limit=16 * 1024 * 1024, **options):
+        """
+        Opens a PDF document from any readable object, including non-seekable ones
+        (pipes, sockets, HTTP request bodies, ...), or from bytes, bytearray, memoryview.
 
-    def __init__(self, stream):
-        self.reader = StreamReader(stream)
+        Buffers are parsed in place and seekable files are read directly. Other streams
+        are read until their end: in memory up to `spool_limit` bytes and, beyond it,
+        into a temporary file that is memory-mapped and removed along with the returned
+        instance (see close()). Worker processes of map_pages open that file again.
+        Other options are given to the constructor.
+        """
+        if isinstance(readable, (bytes, bytearray, memoryview, MappedFile)):
+            return cls(readable, **options)
+
+        seekable = getattr(readable, 'seekable', None)
+        if seekable is not None and seekable():
+            return cls(readable, **options)
+
+        buffer = bytearray()
+        spool = None
+        try:
+            while True:
+                chunk = readable.read(cls.spool_chunk_size)
+                if not chunk:
+                    break
+
+                if spool is None and len(buffer) + len(chunk) > spool_limit:
+                    # Named, so map_pages workers can open it
+                    spool = tempfile.NamedTemporaryFile(prefix='pdfsurge-', suffix='.pdf')
+                    spool.write(buffer)
+                    buffer = None
+
+                if spool is None:
+                    buffer += chunk
+                else:
+                    spool.write(chunk)
+
+            if spool is None:
+                return cls(buffer, **options)
+
+            spool.flush()
+            source = MappedFile(spool.fileno(), 0, access=ACCESS_READ)
+        except Exception:
+            if spool is not None:
+                spool.close()
+            raise
+
+        try:
+            pdf = cls(source, **options)
+        except Exception:
+            cls._release(source)
+            spool.close()
+            raise
+
+        # The spool is removed when it is closed, after the mapping
+        pdf._resources.extend((spool, source))
+        pdf._source = (spool.name, True)
+        return pdf
+
+    @classmethod
+    def probe(cls, path, **options):
+        """
+        Returns the version, the number of pages, whether the document is encrypted,
+        its metadata and the number of xref sections that had to be read, as a PDFProbe,
+        loading as little of the document as possible.
+
+        The document is memory-mapped and only its newest xref section is read (lazily for
+        classic xref tables, see `lazy_xref`), so only the trailer, the catalog, the root of
+        the page tree and the /Info dictionary are loaded, for well-formed documents.
+        Older sections are only read when one of these objects isn't in the newer ones.
+        Other options are given to the constructor.
+        """
+        options.setdefault('lazy_xref', True)
+        with cls.open(path, mmap=True, **options) as pdf:
+            return PDFProbe(
+                version=pdf.get_version(),
+                page_count=pdf.page_count(),
+                encrypted=pdf.is_encrypted(),
+                metadata=MappingProxyType(dict(pdf.get_metadata() or {})),
+                xref_sections=len(pdf._xref_sections)
+            )
+
+    # Size of the chunks read by from_stream
+    spool_chunk_size = 1024 * 1024
+    # Size of the first window read at the end of the document to locate "startxref"
+    tail_window = 1024
+    # get_objects reads objects less than `coalesce_gap` bytes apart at once, up to `coalesce_size` bytes
+    coalesce_gap = 64 * 1024
+    coalesce_size = 1024 * 1024
+
+    def __init__(self, stream, explode=False, cache=None, lazy_streams=False, max_tail=None, tail_timeout=None,
+                 lazy_xref=False, index_cache=None, repair=False, mtime=None):
+        """
+        When `explode` is True, loading an object from an object stream parses
+        all the objects of that stream at once and caches them.
+
+        `cache` holds the loaded objects. It defaults to an unbounded ObjectCache,
+        give an ObjectCache(max_objects=..., max_bytes=...) to bound the memory used.
+        The catalog and the page tree are pinned in it.
+
+        When `lazy_streams` is True, the content of streams is only read when it is
+        accessed (.stream or get_data()), their offset and length being recorded when
+        the object is parsed.
+
+        "%%EOF" and "startxref" are searched for in windows at the end of the document,
+        growing from `tail_window` bytes. `max_tail` bounds the number of bytes searched
+        (the whole document by default) and `tail_timeout` the time spent, in seconds.
+
+        When `lazy_xref` is True, only the newest xref section is read when opening the
+        document. Older sections (/Prev) are read one by one when an object or a trailer
+        key is not found in the sections read so far. If the newest section is a classic
+        xref table, only the position of its subsections is read at first, each entry
+        being read when it is needed (entries have a fixed length).
+
+        `index_cache` is an IndexCache keeping the xref index, the trailer and the
+        pages of the documents on disk: opening the same document again skips reading
+        its xref sections. Documents are told apart by their size, their last bytes and
+        their modification time: `mtime` (in nanoseconds), or the one of the file given.
+        Documents without a modification time (buffers, mappings, pipes) are not cached.
+
+        When `repair` is True, a document whose "startxref" or xref sections are damaged
+        is opened by scanning it for its objects instead (see _reconstruct_xref), and so
+        is a document whose xref index points to the wrong objects once it is found out.
+        The xref sections are then all read when opening the document.
+
+        Objects can be loaded from several threads: each thread reads the document
+        through its own cursor (see StreamReader.cursor) and the cache is thread-safe.
+        """
+        self._reader = StreamReader(stream)
+        # How worker processes open the document again (see map_pages)
+        self._source = None
+        self._options = {
+            'explode': explode, 'lazy_streams': lazy_streams, 'max_tail': max_tail, 'tail_timeout': tail_timeout,
+            'lazy_xref': lazy_xref, 'index_cache': index_cache, 'repair': repair
+        }
+        if isinstance(stream, (io.BufferedReader, io.FileIO)) and isinstance(getattr(stream, 'name', None), str):
+            self._source = (stream.name, False)
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self.explode = explode
+        self.lazy_streams = lazy_streams
+        self._resources = []
 
         self.metadata = None
         self.root = None
         self._pages = None
-        self._cache = {}
+        self._cache = ObjectCache() if cache is None else cache
 
         self.reader.seek(0)
         if self.reader.read(5) != b'%PDF-':
@@ -30,144 +227,549 @@ class PDFSurge:
 
         self.version = float(self.reader.read_until_space())
 
-        self.reader.seek(0, io.SEEK_END)
-        if self.reader.read_until(b'%%EOF', reverse=True) == 0:
-            raise PDFSurgeException('Invalid file given. EOF not found.')
+        self.xref = XrefIndex()
+        self.trailer = {}
+        self.lazy_xref = lazy_xref
+        self._xref_sections = set()
+        # Next section of the xref chain whose trailer is to be merged, _get_trailer reads the trailers
+        # ahead of the sections
+        self._next_trailer = None
+        self._trailer_sections = set()
+        # (start, size, position, entry length) of the subsections of the newest xref table, when read lazily
+        self._sparse_xref = None
+        # (data, /W) of the newest xref section when it is a stream read lazily, the positions
+        # of _sparse_xref are in this data instead of in the document
+        self._sparse_stream = None
+        self.repair = repair
+        self.reconstructed = False
 
-        # Locating startxref
-        self.reader.read_until(b'startxref', reverse=True)
-        self.reader.seek(9, io.SEEK_CUR)
-        startxref = int(self.reader.read_until_space().strip())
+        self._index_cache = index_cache
+        self._index_key = None
+        if index_cache is not None:
+            self._index_key = self._get_index_key(stream, mtime)
 
-        self.xref = {}
-        self._compressed_objs = {}
-        self.trailer = {}
-        # Reading the xref table
-        while True: # Might have multiple xref tables
-            self.reader.seek(startxref, 0)
-            xref = self.reader.read_until_space()
-            if xref[0:4] == b'xref':
-                while True:
-                    num = self.reader.read_until_space()
-                    size = self.reader.read_until_space()
-                    num, size = int(num), int(size)
-                    for i in range(0, size):
-                        self.reader.read_until_char()
-                        offset = self.reader.read_until_space()
-                        generation = self.reader.read_until_space()
-                        self.reader.read_until_space() # Reference ; "f" or "n"
+        if self._index_key is not None:
+            state = index_cache.load(self._index_key)
+            if state is not None and self._restore_index(state):
+                return
 
-                        offset, generation = int(offset), int(generation)
+        try:
+            self._next_xref = self._next_trailer = self._locate_startxref(max_tail, tail_timeout)
 
-                        if num not in self.xref:
-                            self.xref[num] = {}
+            # Reading the xref table
+            if not self._load_next_xref_section():
+                raise PDFSurgeException('Invalid XRef table!')
 
-                        self.xref[num][generation] = offset
-                        num = num + 1
+            if not lazy_xref or repair:
+                # Might have multiple xref tables
+                while self._load_next_xref_section():
+                    pass
+        except (PDFSurgeException, AssertionError, ValueError, TypeError, KeyError, zlib.error):
+            if not repair:
+                raise
 
-                    pos = self.reader.tell()
-                    if self.reader.read_until_space() == b'trailer':
-                        break
-                    else:
-                        # The trailer is not finished, so we continue
-                        # But first, we go back at the beginning of the line
-                        self.reader.seek(pos, io.SEEK_SET)
+            self._reconstruct_xref()
+
+        self._save_index()
+
+    def _get_index_key(self, stream, mtime=None):
+        """ Returns the key of the document in the index cache, or None when its modification time is unknown """
+        if mtime is None:
+            try:
+                mtime = os.fstat(stream.fileno()).st_mtime_ns
+            except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+                # Buffers, mappings and streams that are not files
+                return None
+
+        size = len(self.reader)
+        window = min(size, self.tail_window)
+        return self._index_cache.key(size, mtime, bytes(self.reader.view(size - window, window)))
+
+    def _save_index(self):
+        """ Stores the xref index, the trailer and the pages (once read) in the index cache """
+        if self._index_key is None:
+            return
+
+        with self._lock:
+            self._read_sparse_xref()
+
+        self._index_cache.store(self._index_key, {
+            'xref': self.xref.__getstate__(),
+            'trailer': self.trailer,
+            'next_xref': -1 if self._next_xref is None else self._next_xref,
+            'sections': sorted(self._xref_sections),
+            'pages': self._pages
+        })
+
+    def _restore_index(self, state):
+        """ Restores the state stored in the index cache. Returns False when it is invalid. """
+        try:
+            self.xref.__setstate__(state['xref'])
+            self.trailer = state['trailer']
+            self._next_xref = None if state['next_xref'] < 0 else state['next_xref']
+            self._xref_sections = set(state['sections'])
+            self._next_trailer = self._next_xref
+            self._trailer_sections = set(self._xref_sections)
+            self._pages = state['pages']
+        except (KeyError, TypeError, ValueError, PDFSurgeException):
+            self.xref = XrefIndex()
+            self.trailer = {}
+            self._xref_sections = set()
+            self._pages = None
+            return False
+
+        return True
+
+    @property
+    def reader(self):
+        """ The reader of the document for the current thread """
+        try:
+            return self._local.reader
+        except AttributeError:
+            self._local.reader = self._reader.cursor()
+            return self._local.reader
+
+    def _load_next_xref_section(self):
+        """
+        Reads the next section of the xref chain (the newest first, then following /Prev)
+        and merges it into the xref index and the trailer.
+        Returns False once every section has been read.
+        """
+        with self._lock:
+            return self._load_xref_section()
+
+    def _load_xref_section(self):
+        """ Reads the next section of the xref chain, see _load_next_xref_section """
+        startxref = self._next_xref
+        if startxref is None or startxref in self._xref_sections:
+            # Also protects against /Prev loops
+            self._next_xref = None
+            return False
+
+        # The entries of the previous sections must be known before reading older ones
+        self._read_sparse_xref()
 
-                trailer = parse_stream(self.reader)
+        self._xref_sections.add(startxref)
+        self.reader.seek(startxref, io.SEEK_SET)
+        xref = self.reader.read_until_space()
+        if xref[0:4] == b'xref':
+            trailer = None
+            position = self.reader.tell()
+            if self.lazy_xref and len(self._xref_sections) == 1:
+                trailer = self._index_xref_table()
+            if trailer is None:
+                self.reader.seek(position, io.SEEK_SET)
+                trailer = self._parse_xref_table()
+        elif xref.isdigit():
+            self.reader.read_until_space() # cur_generation
+            assert self.reader.read(3) == b'obj'
+
+            trailer = self._parse_xref_stream(lazy=self.lazy_xref and len(self._xref_sections) == 1)
+        else:
+            raise PDFSurgeException('Invalid XRef table!')
+
+        for k in trailer:
+            if k not in self.trailer:
+                self.trailer[k] = trailer[k]
+
+        self._expect_size(trailer.get('/Size'))
+        self._next_xref = int(trailer['/Prev']) if '/Prev' in trailer else None
+        self._trailer_sections.add(startxref)
+        if self._next_trailer == startxref:
+            self._next_trailer = self._next_xref
+        return True
+
+    def _load_next_trailer(self):
+        """
+        Merges the trailer of the next section of the xref chain into the trailer, without
+        reading its entries (they are read by _load_next_xref_section when needed).
+        Returns False once every trailer has been merged.
+        """
+        with self._lock:
+            startxref = self._next_trailer
+            if startxref is None or startxref in self._trailer_sections:
+                self._next_trailer = None
+                return False
+
+            self._trailer_sections.add(startxref)
+            self.reader.seek(startxref, io.SEEK_SET)
+            xref = self.reader.read_until_space()
+            if xref[0:4] == b'xref':
+                # The entries are made of digits, spaces and "f" or "n" only
+                position = self.reader.find(b'trailer')
+                if position < 0:
+                    raise PDFSurgeException('Invalid XRef table!')
+                self.reader.seek(position + 7, io.SEEK_SET)
             elif xref.isdigit():
                 self.reader.read_until_space() # cur_generation
                 assert self.reader.read(3) == b'obj'
-
-                obj = PDFObject.parse(self.reader)
-                trailer = obj.properties
-                if '/Type' not in trailer or trailer['/Type'] != '/XRef':
-                    raise PDFSurgeException('Not a valid 1.5+ XRef table!')
-
-                stream_data = BytesIO(obj.get_data())
-                idrange = trailer.get('/Index', [0, trailer.get('/Size')])
-                entry_sizes = trailer.get('/W')
-                assert len(entry_sizes) == 3
-
-                def _pairs(array):
-                    i = 0
-                    while True:
-                        yield array[i], array[i + 1]
-                        i += 2
-                        if (i + 1) >= len(array):
-                            break
-                
-                def _convertToInt(d, size):
-                    if size > 8:
-                        raise PDFSurgeException("Invalid size in _convertToInt")
-
-                    assert isinstance(d, bytes)
-                    d = b"\x00\x00\x00\x00\x00\x00\x00\x00" + d
-                    d = d[-8:]
-                    return struct.unpack(">q", d)[0]
-                
-                def _get_entry(i):
-                    """
-                    Reads the correct number of bytes for each entry. See the
-                    discussion of the W parameter in PDF spec table 17.
-                    """
-                    if entry_sizes[i] > 0:
-                        d = stream_data.read(entry_sizes[i])
-                        return _convertToInt(d, entry_sizes[i])
-                    
-                    # PDF Spec Table 17: A value of zero for an element in the
-                    # W array indicates...the default value shall be used
-
-                    # First value defaults to 1
-                    return 1 if i == 0 else 0
-
-                def _used_before(num, generation):
-                    # We move backwards through the xrefs, don't replace any.
-                    return generation in self.xref.get(num, []) or num in self._compressed_objs
-
-                last_end = 0
-                for start, size in _pairs(idrange):
-                    assert start >= last_end
-                    last_end = start + size
-                
-                    for num in range(start, start + size):
-                        xref_type = _get_entry(0)
-                        if xref_type == 0:
-                            # Linked list of free objects
-                            obj_num = _get_entry(1)
-                            generation = _get_entry(2)
-                            self._compressed_objs[num] = (obj_num, generation, 0)
-
-                        elif xref_type == 1:
-                            offset = _get_entry(1)
-                            generation = _get_entry(2)
-
-                            if num not in self.xref:
-                                self.xref[num] = {}
-                            
-                            if not _used_before(num, generation):
-                                self.xref[num][generation] = offset
-                        elif xref_type == 2:
-                            # Compressed objects!
-                            obj_num = _get_entry(1)
-                            obj_idx = _get_entry(2)
-                            generation = 0  # PDF spec table 18, generation is 0
-
-                            if not _used_before(num, generation):
-                                self._compressed_objs[num] = (obj_num, obj_idx, 2)
-                        else:
-                            raise PDFSurgeException('Unknow xref type {0}'.format(xref_type))
             else:
                 raise PDFSurgeException('Invalid XRef table!')
 
+            # For xref streams, only the dictionary is read
+            trailer = parse_stream(self.reader)
+            if not isinstance(trailer, dict):
+                raise PDFSurgeException('Invalid XRef table!')
+
             for k in trailer:
                 if k not in self.trailer:
                     self.trailer[k] = trailer[k]
 
-            if '/Prev' in trailer:
-                startxref = int(trailer['/Prev'])
+            self._next_trailer = int(trailer['/Prev']) if '/Prev' in trailer else None
+            return True
+
+    def _expect_size(self, size):
+        """
+        Lets the xref index hold `size` objects in its arrays (see XrefIndex.expect).
+        Each object takes at least one byte of the document, which bounds a bogus /Size.
+        """
+        if isinstance(size, int) and size > 0:
+            self.xref.expect(min(size, len(self.reader)))
+
+    def _index_xref_table(self):
+        """
+        Reads the position of the subsections of a classic xref table, right after the "xref"
+        keyword, and returns the trailer dictionary that follows them. Entries are read by
+        _get_entry when they are needed.
+        Returns None when the size of the entries can't be told, the table must be read entirely.
+        """
+        subsections = []
+        while True:
+            self.reader.read_until_char()
+            if self.reader.peek(7) == b'trailer':
+                self.reader.read(7)
+                break
+
+            num = int(self.reader.read_until_space())
+            size = int(self.reader.read_until_space())
+            if size == 0:
+                continue
+
+            self.reader.read_until_char()
+            position = self.reader.tell()
+            match = _re_xref_entry_loose.match(self.reader.peek(20))
+            if match is None:
+                return None
+
+            # 20 bytes as required, or 19 bytes for the tables with a single end of line character
+            length = match.end()
+            subsections.append((num, size, position, length))
+            self.reader.seek(position + size * length, io.SEEK_SET)
+
+        trailer = parse_stream(self.reader)
+        self._sparse_xref = subsections
+        return trailer
+
+    def _read_sparse_entry(self, num):
+        """ Reads the entry of the given object in the newest xref table, when it was read lazily """
+        for start, size, position, length in self._sparse_xref:
+            if start <= num < start + size:
+                if self._sparse_stream is not None:
+                    data, widths = self._sparse_stream
+                    xref_type, field, index = decode_xref_entry(data, widths, position + (num - start) * length)
+                    if xref_type > COMPRESSED:
+                        raise PDFSurgeException('Unknow xref type {0}'.format(xref_type))
+                    self.xref.add(num, xref_type, field, index)
+                    return
+
+                entry = bytes(self.reader.view(position + (num - start) * length, length))
+                match = _re_xref_entry_loose.fullmatch(entry)
+                if match is None:
+                    self._read_sparse_xref()
+                    return
+
+                offset, generation, kind = match.groups()
+                self.xref.add(num, IN_USE if kind == b'n' else FREE, int(offset), int(generation))
+                return
+
+    def _read_sparse_xref(self):
+        """ Reads all the entries of the newest xref table, when it was read lazily """
+        if self._sparse_xref is None:
+            return
+
+        subsections = self._sparse_xref
+        self._sparse_xref = None
+        if self._sparse_stream is not None:
+            data, widths = self._sparse_stream
+            self._sparse_stream = None
+            self._index_xref_stream(data, widths, subsections)
+            return
+
+        for start, size, position, _ in subsections:
+            self.reader.seek(position, io.SEEK_SET)
+            self._parse_xref_subsection(start, size)
+
+    def _reconstruct_xref(self):
+        """
+        Rebuilds the xref index and the trailer of a damaged document from the objects
+        found by scanning the whole document (see scan_objects).
+
+        The object streams found are decoded to index the objects they hold, an object
+        defined both in an object stream and directly keeping its last definition.
+        The trailer is merged from the "trailer" dictionaries and the xref streams found,
+        the newest first, and the catalog is searched for if none of them gives a valid /Root.
+        """
+        with self._lock:
+            if not self.reconstructed:
+                self._rebuild_xref()
+
+    def _rebuild_xref(self):
+        objects, trailers, markers = scan_objects(self.reader)
+        if not objects:
+            raise PDFSurgeException('Invalid file given. No objects were found.')
+
+        self.reconstructed = True
+        self._next_xref = self._next_trailer = None
+        self._sparse_xref = self._sparse_stream = None
+        self._xref_sections = set()
+        self._pages = None
+        self.root = None
+        self._cache.clear()
+
+        # Direct objects first, so the object streams can be loaded
+        self.xref = XrefIndex()
+        self._expect_size(max(objects) + 1)
+        for num, (offset, generation) in objects.items():
+            self.xref.add(num, IN_USE, offset, generation)
+
+        compressed = {}
+        for offset, num, kind in markers:
+            if kind != '/ObjStm':
+                continue
+
+            try:
+                objstm = self._get_object_stream(num)
+            except (PDFSurgeException, AssertionError, ValueError, TypeError, KeyError, zlib.error):
+                continue
+
+            for index, member in enumerate(objstm.numbers):
+                if member in objects and objects[member][0] > offset:
+                    continue  # Defined again after this object stream
+                if member not in compressed or compressed[member][0] < offset:
+                    compressed[member] = (offset, num, index)
+
+        xref = XrefIndex()
+        xref.expect(min(max(max(objects), max(compressed, default=0)) + 1, len(self.reader)))
+        for member, (_, num, index) in compressed.items():
+            xref.add(member, COMPRESSED, num, index)
+        for num, (offset, generation) in objects.items():
+            xref.add(num, IN_USE, offset, generation)
+        self.xref = xref
+
+        # Trailers, the newest first
+        candidates = [(position, None) for position in trailers]
+        candidates += [(offset, num) for offset, num, kind in markers if kind == '/XRef']
+        self.trailer = {}
+        for position, num in sorted(candidates, reverse=True):
+            try:
+                if num is None:
+                    self.reader.seek(position, io.SEEK_SET)
+                    trailer = parse_stream(self.reader)
+                else:
+                    trailer = self.get_object((num, objects[num][1])).properties
+            except (PDFSurgeException, AssertionError, ValueError, TypeError, KeyError, zlib.error):
+                continue
+
+            if not isinstance(trailer, dict):
+                continue
+
+            for key in ('/Root', '/Info', '/Encrypt', '/ID'):
+                if key in trailer and key not in self.trailer:
+                    self.trailer[key] = trailer[key]
+
+        self.trailer['/Size'] = max(max(objects), max(compressed, default=0)) + 1
+
+        if not self._is_catalog(self.trailer.get('/Root')):
+            self.trailer.pop('/Root', None)
+            catalogs = [(offset, num) for offset, num, kind in markers if kind == '/Catalog']
+            for offset, num in sorted(catalogs, reverse=True):
+                if self._is_catalog((num, objects[num][1])):
+                    self.trailer['/Root'] = (num, objects[num][1])
+                    break
+            else:
+                # The catalog might be in an object stream
+                for member in compressed:
+                    if self._is_catalog((member, 0)):
+                        self.trailer['/Root'] = (member, 0)
+                        break
+
+        if '/Root' not in self.trailer:
+            raise PDFSurgeException('Invalid file given. No catalog was found.')
+
+    def _is_catalog(self, path):
+        if not isinstance(path, tuple):
+            return False
+
+        try:
+            obj = self.get_object(path)
+        except (PDFSurgeException, AssertionError, ValueError, TypeError, KeyError, zlib.error):
+            return False
+
+        return isinstance(obj.properties, dict) and obj.properties.get('/Type') == '/Catalog'
+
+    def _get_trailer(self, key):
+        """
+        Returns the given key of the trailer, reading the trailers of older xref sections when
+        it's missing, so the newest trailer setting it wins, as when all the sections are loaded
+        at once. Their entries are not read.
+        """
+        while key not in self.trailer and self._load_next_trailer():
+            pass
+
+        return self.trailer.get(key)
+
+    def _locate_startxref(self, max_tail=None, timeout=None):
+        """
+        Returns the offset given after the last "startxref" of the document.
+
+        The end of the document is read by windows growing from `tail_window` bytes,
+        up to `max_tail` bytes, so well-formed files only need the first one.
+        """
+        size = len(self.reader)
+        limit = size if max_tail is None else min(size, max_tail)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        window = self.tail_window
+        while True:
+            window = min(window, limit)
+            tail = bytes(self.reader.view(size - window, window))
+            eof = tail.rfind(b'%%EOF')
+            if eof > -1:
+                match = _re_startxref.search(tail, max(0, tail.rfind(b'startxref', 0, eof)), eof)
+                if match:
+                    return int(match.group(1))
+
+            if window >= limit:
+                if eof < 0:
+                    raise PDFSurgeException('Invalid file given. EOF not found.')
+                raise PDFSurgeException('Invalid file given. startxref not found.')
+
+            if deadline is not None and time.monotonic() > deadline:
+                raise PDFSurgeException('Invalid file given. EOF not found in the given time.')
+
+            window *= 4
+
+    def _parse_xref_table(self):
+        """
+        Reads the subsections of a classic xref table, right after the "xref" keyword,
+        and returns the trailer dictionary that follows them.
+
+        Each subsection is read at once and decoded with a regular expression, as entries
+        are 20 bytes long. Subsections with non-conforming line endings are tokenized.
+        """
+        while True:
+            self.reader.read_until_char()
+            if self.reader.peek(7) == b'trailer':
+                self.reader.read(7)
+                break
+
+            num = int(self.reader.read_until_space())
+            size = int(self.reader.read_until_space())
+            if size == 0:
                 continue
 
-            break
+            self._parse_xref_subsection(num, size)
+
+        return parse_stream(self.reader)
+
+    def _parse_xref_subsection(self, num, size):
+        """ Reads the `size` entries of a subsection starting at object `num` """
+        self.reader.read_until_char()
+        start = self.reader.tell()
+        entries = _re_xref_entry.findall(self.reader.read(size * 20))
+        if len(entries) != size:
+            self.reader.seek(start, io.SEEK_SET)
+            entries = []
+            for i in range(0, size):
+                offset = self.reader.read_until_space()
+                generation = self.reader.read_until_space()
+                entries.append((offset, generation, self.reader.read_until_space()))
+
+        # Free entries are not objects, but they hide the older definitions
+        self.xref.update(
+            num,
+            [IN_USE if kind == b'n' else FREE for _, _, kind in entries],
+            [int(offset) for offset, _, _ in entries],
+            [int(generation) for _, generation, _ in entries]
+        )
+
+    def _parse_xref_stream(self, lazy=False):
+        """
+        Reads a cross-reference stream (PDF 1.5+), right after its "obj" keyword,
+        and returns its dictionary, which acts as the trailer.
+        When `lazy` is set, the entries are decoded by _get_entry when they are needed.
+        """
+        obj = PDFObject.parse(self.reader)
+        trailer = obj.properties
+        if '/Type' not in trailer or trailer['/Type'] != '/XRef':
+            raise PDFSurgeException('Not a valid 1.5+ XRef table!')
+
+        self._expect_size(trailer.get('/Size'))
+        idrange = trailer.get('/Index', [0, trailer.get('/Size')])
+        widths = trailer.get('/W')
+        if not isinstance(widths, list) or len(widths) != 3 or any(not isinstance(w, int) or w < 0 or w > 8 for w in widths):
+            raise PDFSurgeException('Invalid /W array {0} for the xref stream.'.format(widths))
+
+        data = obj.get_data()
+        entry_size = sum(widths)
+        count = len(data) // entry_size if entry_size else 0
+
+        # (start, size, position of the first entry in the data, entry size) of the subsections
+        subsections = []
+        position = 0
+        last_end = 0
+        for i in range(0, len(idrange) - 1, 2):
+            start, size = idrange[i], idrange[i + 1]
+            assert start >= last_end
+            last_end = start + size
+
+            if position + size > count:
+                raise PDFSurgeException('XRef stream is shorter than its /Index.')
+
+            if size:
+                subsections.append((start, size, position * entry_size, entry_size))
+            position += size
+
+        if lazy:
+            self._sparse_xref = subsections
+            self._sparse_stream = (data, widths)
+        else:
+            self._index_xref_stream(data, widths, subsections)
+
+        return trailer
+
+    def _index_xref_stream(self, data, widths, subsections):
+        """ Records the entries of the given subsections of a cross-reference stream """
+        types, fields, indexes = decode_xref_stream(data, widths)
+        for start, size, position, entry_size in subsections:
+            position //= entry_size
+            section = types[position:position + size]
+            if section.tobytes().translate(None, bytes(range(COMPRESSED + 1))):
+                raise PDFSurgeException('Unknow xref type {0}'.format(max(section)))
+
+            # For compressed objects, fields are the ObjStm number and the index in it
+            # (PDF spec table 18, generation is 0)
+            self.xref.update(start, section, fields[position:position + size], indexes[position:position + size])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Closes the file (or mapping) opened by PDFSurge.open. """
+        while self._resources:
+            self._release(self._resources.pop())
+
+    @staticmethod
+    def _release(resource):
+        try:
+            resource.close()
+        except BufferError:
+            # Streams contents are still referencing the mapping,
+            # it will be released along with the last of them.
+            pass
 
     def get_version(self):
         return self.version
@@ -178,8 +780,8 @@ class PDFSurge:
     def get_metadata(self):
         if not self.metadata:
             # Reading the INFO object
-            if '/Info' in self.trailer:
-                info = self.trailer['/Info']
+            info = self._get_trailer('/Info')
+            if info is not None:
                 try:
                     self.metadata = self.get_object(info).properties
                 except PDFSurgeException:
@@ -192,7 +794,9 @@ class PDFSurge:
 
     def get_root(self):
         if self.root is None:
-            self.root = self.get_object(self.trailer['/Root'])
+            root = self._get_trailer('/Root')
+            self._cache.pin(tuple(root[:2]))
+            self.root = self.get_object(root)
             assert self.root.properties.get('/Type') == '/Catalog'
         
         return self.root
@@ -202,74 +806,393 @@ class PDFSurge:
         self.root[prop] = value
     
     def get_pages(self):
-        if not self._pages:
-            self._pages = []
+        if self._pages is None:
             assert '/Pages' in self.get_root().properties
-            pages = self.get_object(self.get_root().properties['/Pages'])
-            self._get_pages(pages)
+            self._pages = self._get_pages(tuple(self.get_root().properties['/Pages'][:2]))
+            self._save_index()
 
         return len(self._pages)
     
-    def _get_pages(self, obj):
-        if obj.properties.get('/Type') == '/Pages':
-            for page in obj.properties.get('/Kids'):
-                p = self.get_object(page)
-                self._get_pages(p)
-        elif obj.properties.get('/Type') == '/Page':
-            self._pages.append(obj)
-        else:
-            raise PDFSurgeException('Unexpected type {0} for pages'.format(obj.properties.get('/Type')))
+    def _get_pages(self, root):
+        """
+        Returns the references of the pages under the given node of the page tree, in order.
+        The tree is loaded level by level, each level being read at once with get_objects.
+        """
+        kids = {}
+        level = [root]
+        seen = {root}
+        while level:
+            following = []
+            for path, obj in zip(level, self.get_objects(level)):
+                if obj.properties.get('/Type') == '/Pages':
+                    self._cache.pin(path)
+                    kids[path] = [tuple(kid[:2]) for kid in obj.properties.get('/Kids')]
+                    for kid in kids[path]:
+                        if kid not in seen:
+                            seen.add(kid)
+                            following.append(kid)
+                elif obj.properties.get('/Type') != '/Page':
+                    raise PDFSurgeException('Unexpected type {0} for pages'.format(obj.properties.get('/Type')))
+            level = following
+
+        pages = []
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            if path in kids:
+                # A node is only visited once, in case the tree has a loop
+                stack.extend(reversed(kids.pop(path)))
+            else:
+                pages.append(path)
+
+        return pages
     
+    def page_count(self):
+        """ Returns the number of pages, as given by the /Count of the page tree """
+        if self._pages is not None:
+            return len(self._pages)
+
+        count = self._get_value(self._get_page_tree().properties.get('/Count'))
+        if not isinstance(count, int) or count < 0:
+            # Damaged page tree
+            return self.get_pages()
+
+        return count
+
+    def get_page(self, index):
+        """
+        Returns the page at the given index (starting at 0, negative indexes counting from the end),
+        with the attributes it inherits from the page tree (/Resources, /MediaBox, ...) set
+        (on a copy, see _with_inherited).
+
+        The page tree is descended using the /Count of its nodes, so only the nodes leading
+        to the page (and their kids) are loaded.
+        """
+        if index < 0:
+            index += self.page_count()
+        if index < 0:
+            raise IndexError('Page index out of range.')
+
+        if self._pages is not None:
+            if index >= len(self._pages):
+                raise IndexError('Page index out of range.')
+            return self._inherit(self.get_object(self._pages[index]))
+
+        remaining = index
+        node = self._get_page_tree()
+        seen = set()
+        while True:
+            kids = [tuple(kid[:2]) for kid in self._get_value(node.properties.get('/Kids')) or []]
+            for kid, obj in zip(kids, self.get_objects(kids)):
+                if '/Kids' not in obj.properties:
+                    count = 1
+                else:
+                    count = self._get_value(obj.properties.get('/Count'))
+                    if not isinstance(count, int) or count < 0 or kid in seen:
+                        # Damaged page tree, the pages are listed instead
+                        self.get_pages()
+                        return self.get_page(index)
+
+                if remaining < count:
+                    break
+                remaining -= count
+            else:
+                raise IndexError('Page index out of range.')
+
+            if '/Kids' not in obj.properties:
+                return self._inherit(obj)
+
+            seen.add(kid)
+            self._cache.pin(kid)
+            node = obj
+
+    def iter_pages(self):
+        """
+        Yields the pages, in order, with the attributes they inherit from the page tree set
+        (on copies, see _with_inherited).
+        The page tree is walked iteratively, the kids of each node being read at once.
+        """
+        root = self._get_page_tree()
+        stack = [(iter([(None, root)]), {})]
+        seen = set()
+        while stack:
+            kids, inherited = stack[-1]
+            path, obj = next(kids, (None, None))
+            if obj is None:
+                stack.pop()
+                continue
+
+            if '/Kids' not in obj.properties:
+                yield self._with_inherited(obj, inherited)
+                continue
+
+            if path in seen:
+                continue  # The page tree has a loop
+            seen.add(path)
+
+            inherited = dict(inherited)
+            inherited.update((key, obj.properties[key]) for key in inheritable if key in obj.properties)
+            paths = [tuple(kid[:2]) for kid in self._get_value(obj.properties.get('/Kids')) or []]
+            stack.append((zip(paths, self.get_objects(paths)), inherited))
+
+    def map_pages(self, func, pages=None, workers=None, chunk_size=8):
+        """
+        Calls `func(pdf, page)` for each of the given page indexes (all the pages by default)
+        in worker processes, and yields the results in the order of the pages.
+
+        Each worker opens the document once, by its path (memory-mapping it too when it
+        was opened with mmap=True, or spooled by from_stream). Documents given as buffers
+        have no path: a PDFSurgeException is raised, rather than copying the whole document
+        to every worker, unless a single worker is used.
+        Pages are sent to the workers by chunks of `chunk_size`, and no more than two chunks
+        per worker are pending at once, so results are computed as they are consumed.
+        `func` must be picklable (defined at the top level of a module).
+        With a single worker, the pages are processed in the current process.
+        """
+        if pages is None:
+            pages = range(self.page_count())
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        if workers <= 1:
+            for index in pages:
+                yield func(self, self.get_page(index))
+            return
+
+        if self._source is None:
+            raise PDFSurgeException(
+                'map_pages needs a document the workers can open by its path '
+                '(PDFSurge.open, or from_stream beyond spool_limit), use workers=1 for in-memory documents.'
+            )
+
+        pages = iter(pages)
+        with ProcessPoolExecutor(workers, initializer=_open_worker, initargs=(self._source, self._options)) as executor:
+            pending = deque()
+            try:
+                while True:
+                    while len(pending) < workers * 2:
+                        chunk = list(islice(pages, chunk_size))
+                        if not chunk:
+                            break
+                        pending.append(executor.submit(_map_worker, func, chunk))
+
+                    if not pending:
+                        break
+
+                    for result in pending.popleft().result():
+                        yield result
+            finally:
+                # When the results are not all consumed
+                for future in pending:
+                    future.cancel()
+
+    def _get_page_tree(self):
+        """ Returns the root node of the page tree """
+        root = self.get_root().properties.get('/Pages')
+        if not isinstance(root, tuple):
+            raise PDFSurgeException('The catalog has no page tree.')
+
+        self._cache.pin(tuple(root[:2]))
+        return self.get_object(root)
+
+    def _inherit(self, page):
+        """ Returns the page with the attributes it inherits from its ancestors, following its /Parent """
+        inherited = {}
+        parent = page.properties.get('/Parent')
+        seen = set()
+        while isinstance(parent, tuple) and parent[:2] not in seen:
+            seen.add(parent[:2])
+            node = self.get_object(parent)
+            for key in inheritable:
+                if key in node.properties:
+                    inherited.setdefault(key, node.properties[key])
+            parent = node.properties.get('/Parent')
+
+        return self._with_inherited(page, inherited)
+
+    def _with_inherited(self, page, inherited):
+        """
+        Returns the page with the given inherited attributes it doesn't set itself.
+        The page is copied when some are missing: the cached object is left as read,
+        so get_object returns the same whether the page was listed or not.
+        """
+        missing = {key: value for key, value in inherited.items() if key not in page.properties}
+        if not missing:
+            return page
+
+        page = copy.copy(page)
+        missing.update(page.properties)
+        page.properties = page.value = missing
+        return page
+
+    def _get_value(self, value):
+        """ Returns the given value, or the value it references """
+        if isinstance(value, tuple):
+            return self._resolve(value)
+
+        return value
+
+    def get_objects(self, paths):
+        """
+        Returns the objects of the given references, in the same order.
+
+        Objects are read ordered by their position in the document rather than by
+        the order of the references: objects close to each other are read at once
+        (see `coalesce_gap` and `coalesce_size`), and the objects stored in the same
+        object stream are extracted together once it is loaded.
+        """
+        paths = [tuple(path[:2]) for path in paths]
+
+        objects = {}
+        direct = []
+        compressed = {}
+        for path in dict.fromkeys(paths):
+            obj = self._cache.get(path)
+            if obj is not None:
+                objects[path] = obj
+                continue
+
+            entry = self._get_entry(*path)
+            if entry is not None and entry[0] == COMPRESSED:
+                compressed.setdefault(entry[1], []).append((entry[2], path))
+            elif entry is not None:
+                direct.append((entry[1], path))
+
+        # The object streams are read along with the other objects
+        for num in compressed:
+            entry = self._get_entry(num, 0)
+            if self._cache.get(('/ObjStm', num)) is None and entry is not None and entry[0] == IN_USE:
+                direct.append((entry[1], (num, 0)))
+
+        direct.sort()
+        fetched = -1
+        for i, (offset, path) in enumerate(direct):
+            if offset >= fetched:
+                end = offset
+                for following, _ in direct[i + 1:]:
+                    if following - end > self.coalesce_gap or following - offset > self.coalesce_size:
+                        break
+                    end = following
+
+                fetched = end + 1
+                self.reader.prefetch(offset, end - offset + self.reader.block_size)
+
+            objects[path] = self.get_object(path)
+
+        for num in sorted(compressed, key=lambda num: (self._get_entry(num, 0) or (0, 0))[1]):
+            for _, path in sorted(compressed[num]):
+                objects[path] = self.get_object(path)
+
+        # Objects that were not found raise an exception here
+        return [objects[path] if path in objects else self.get_object(path) for path in paths]
+
     def get_object(self, path):
         idnum, generation = path[:2]
 
-        if self._cache.get(idnum, {}).get(generation, None):
-            return self._cache[idnum][generation]
+        obj = self._cache.get((idnum, generation))
+        if obj is not None:
+            return obj
 
-        if idnum in self.xref and generation in self.xref[idnum]:
-            index = self.xref[idnum][generation]
+        entry = self._get_entry(idnum, generation)
+        if entry is not None and entry[0] == IN_USE:
+            index = entry[1]
             self.reader.seek(index, io.SEEK_SET)
 
-            cur_num = self.reader.read_until_space()
-            cur_generation = self.reader.read_until_space()
+            try:
+                cur_num = self.reader.read_until_space()
+                cur_generation = self.reader.read_until_space()
 
-            assert int(cur_num) == idnum
-            assert int(cur_generation) == generation
-            assert self.reader.read(3) == b'obj'
+                assert int(cur_num) == idnum
+                assert int(cur_generation) == generation
+                assert self.reader.read(3) == b'obj'
+            except (AssertionError, ValueError, PDFSurgeStreamError):
+                if not self.repair or self.reconstructed:
+                    raise
 
-            obj = PDFObject.parse(self.reader)
-            if idnum not in self._cache:
-                self._cache[idnum] = {}
-            
-            self._cache[idnum][generation] = obj
+                # The xref index is wrong
+                self._reconstruct_xref()
+                return self.get_object(path)
+
+            obj = PDFObject.parse(self.reader, resolve=self._resolve, lazy=self.lazy_streams)
+            self._cache.put((idnum, generation), obj)
+            return obj
+        elif entry is not None and entry[0] == COMPRESSED:
+            container, index = entry[1], entry[2]
+            try:
+                objstm = self._get_object_stream(container)
+            except (PDFSurgeException, AssertionError, ValueError, TypeError, KeyError, zlib.error):
+                if not self.repair or self.reconstructed:
+                    raise
+
+                # The object stream can't be decoded, or the xref index is wrong:
+                # the objects of the streams that can be decoded are indexed again
+                self._reconstruct_xref()
+                return self.get_object(path)
+
+            if idnum not in objstm:
+                raise PDFSurgeException('Object {0} was not found in object stream {1}'.format(idnum, container))
+
+            if self.explode:
+                return self._explode_object_stream(container, objstm, idnum)
+
+            obj = objstm.get(idnum)
+            self._cache.put((idnum, 0), obj)
             return obj
-        elif idnum in self._compressed_objs:
-            indirect = self._compressed_objs[idnum]
-            obj = self.get_object((indirect[0], 0))  # "generation" is always 0
-            assert obj.properties.get('/Type') == '/ObjStm'
-            assert indirect[1] < obj.properties.get('/N')
-            data = StreamReader(BytesIO(obj.get_data()))
-            for i in range(obj.properties.get('/N')):
-                obj_num = data.read_until_space()
-                obj_offset = data.read_until_space()
-
-                if int(obj_num) != idnum:
-                    continue
-                assert i == indirect[1]  # object index
-
-                data.seek(obj.properties.get('/First') + int(obj_offset), io.SEEK_SET)
-
-                obj = PDFObject.parse(data, endobj=False)
-                if idnum not in self._cache:
-                    self._cache[idnum] = {}
-                
-                self._cache[idnum][0] = obj
-                return obj
 
         raise PDFSurgeException('Object {0} with generation {1} was not found'.format(idnum, generation))
     
+    def _get_entry(self, idnum, generation=0):
+        """ Returns the xref entry of the given object, reading older xref sections when it's missing """
+        entry = self.xref.get(idnum, generation)
+        if entry is None and self._sparse_xref is not None:
+            with self._lock:
+                if self._sparse_xref is not None:
+                    self._read_sparse_entry(idnum)
+            entry = self.xref.get(idnum, generation)
+
+        while entry is None and self._load_next_xref_section():
+            entry = self.xref.get(idnum, generation)
+
+        return entry
+
+    def _resolve(self, value):
+        """ Returns the value of the given indirect reference """
+        return self.get_object(value).value
+
+    def _get_object_stream(self, num):
+        """ Returns the ObjectStream of the given number, decoding it only once (while it is cached). """
+        key = ('/ObjStm', num)
+        objstm = self._cache.get(key)
+        if objstm is None:
+            container = self.get_object((num, 0))  # "generation" is always 0
+            objstm = ObjectStream(container)
+            self._cache.put(key, objstm)
+
+        return objstm
+
+    def _explode_object_stream(self, num, objstm, idnum):
+        """
+        Parses all the objects of an object stream in one sweep, and caches those that
+        the xref index locates in this stream (others are outdated revisions).
+        Members are matched by the number of their stream only, as the index given by
+        the xref index doesn't always match their position in the stream.
+        Returns the object `idnum`.
+        """
+        result = None
+        for index, member, obj in objstm.items():
+            entry = self.xref.get(member)
+            if entry is not None and entry[0] == COMPRESSED and entry[1] == num:
+                self._cache.put((member, 0), obj)
+            if member == idnum and result is None:
+                result = obj
+
+        if result is None:
+            result = objstm.get(idnum)
+
+        return result
+
     def is_encrypted(self):
-        return '/Encrypt' in self.trailer
+        return self._get_trailer('/Encrypt') is not None
     
     def get_page_mode(self):
         if '/PageMode' in self.get_root():
@@ -347,3 +1270,17 @@ class PDFSurge:
 
     
     # @see https://stackoverflow.com/a/25835284/330867 for grayscale
+
+
+# The document opened by a worker process of PDFSurge.map_pages
+_worker_document = None
+
+
+def _open_worker(source, options):
+    global _worker_document
+    path, mmap = source
+    _worker_document = PDFSurge.open(path, mmap=mmap, **options)
+
+
+def _map_worker(func, indexes):
+    return [func(_worker_document, _worker_document.get_page(index)) for index in indexes]
@@ -4,125 +4,363 @@ __author__ = "Cyril Nicodeme"
 __author_email__ = "cyril@pdfshift.io"
 
 from pdfsurge.exceptions import PDFSurgeStreamError
-import io
+import copy, io, os, re, mmap, threading
+
+
+# Same set of characters as bytes.isspace()
+WHITESPACES = b' \t\n\r\x0b\x0c'
+
+_re_word = re.compile(b'[' + re.escape(WHITESPACES) + b']*([^' + re.escape(WHITESPACES) + b']*)[' + re.escape(WHITESPACES) + b']?')
+_re_word_blocking = re.compile(b'([^' + re.escape(WHITESPACES) + b']*)[' + re.escape(WHITESPACES) + b']?')
+_re_spaces = re.compile(b'[' + re.escape(WHITESPACES) + b']*')
 
 
 class StreamReader:
-    def __init__(self, stream):
-        if not isinstance(stream, io.BytesIO) and 'b' not in stream.mode:
-            raise PDFSurgeStreamError('Stream object must be opened in binary mode.')
+    """
+    Reads a PDF document, either from a binary file or from an in-memory buffer
+    (bytes, bytearray, memoryview, mmap or BytesIO).
+
+    Files are read into a reusable buffer and buffers are scanned in place, so
+    the scanning methods (read_until_space, read_until, ...) rely on regular
+    expressions and find/rfind over a window instead of reading the stream one
+    byte at a time.
+    A read at a new position fills a window of `min_block_size` bytes, enough for
+    most objects, and the window doubles up to `block_size` bytes while the reads
+    go on past its end, so sequential scans still read large blocks.
+
+    A reader has a single position, and must not be used by several threads.
+    cursor() gives another reader over the same document, with its own position:
+    regular files are read with positional reads (os.pread), which don't share any
+    state, and other file objects are read under a lock shared by the cursors.
+    """
+    block_size = 64 * 1024
+    min_block_size = 4 * 1024
 
+    _patterns = {}
+
+    def __init__(self, stream):
         self.stream = stream
-    
+        self._pos = 0
+
+        if isinstance(stream, io.BytesIO):
+            # getvalue() does not copy the data when the BytesIO was not modified
+            stream = stream.getvalue()
+
+        if isinstance(stream, (bytes, bytearray, memoryview, mmap.mmap)):
+            self._file = None
+            self._buffer = stream
+            self._start = 0
+            self._size = self._end = len(stream)
+        else:
+            if 'b' not in getattr(stream, 'mode', 'b'):
+                raise PDFSurgeStreamError('Stream object must be opened in binary mode.')
+
+            self._file = stream
+            self._buffer = bytearray()
+            self._start = self._end = 0
+            self._block = self.min_block_size
+            self._size = stream.seek(0, io.SEEK_END)
+            self._fd = None
+            self._lock = threading.Lock()
+            if isinstance(stream, io.IOBase) and hasattr(os, 'pread'):
+                try:
+                    self._fd = stream.fileno()
+                except (OSError, ValueError):
+                    pass
+
+    def __len__(self):
+        return self._size
+
+    def cursor(self):
+        """ Returns a new reader over the same document, at position 0, that can be used by another thread """
+        reader = copy.copy(self)
+        reader._pos = 0
+        if self._file is not None:
+            reader._buffer = bytearray()
+            reader._start = reader._end = 0
+            reader._block = self.min_block_size
+
+        return reader
+
+    def _read_at(self, pos, length):
+        """ Reads up to `length` bytes of the file at `pos` """
+        if self._fd is not None:
+            return os.pread(self._fd, length, pos)
+
+        with self._lock:
+            self._file.seek(pos, io.SEEK_SET)
+            return self._file.read(length)
+
+    def _readinto_at(self, pos, buffer):
+        """ Reads the file at `pos` into the given buffer, returns the number of bytes read """
+        if self._fd is not None and hasattr(os, 'preadv'):
+            return os.preadv(self._fd, [buffer], pos)
+
+        if self._fd is None and hasattr(self._file, 'readinto'):
+            with self._lock:
+                self._file.seek(pos, io.SEEK_SET)
+                return self._file.readinto(buffer) or 0
+
+        data = self._read_at(pos, len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def _fill(self, pos, length):
+        """ Makes sure the window holds the bytes in [pos, pos + length), as far as the stream allows. """
+        if self._start <= pos and (pos + length <= self._end or self._end == self._size):
+            return
+
+        if self._start < self._end and self._start <= pos <= self._end:
+            # Reading on past the window
+            self._block = min(self._block * 2, self.block_size)
+        else:
+            self._block = self.min_block_size
+
+        length = max(length, self._block)
+        if len(self._buffer) < length:
+            self._buffer = bytearray(length)
+
+        with memoryview(self._buffer) as view:
+            read = self._readinto_at(pos, view[:length])
+
+        self._start = pos
+        self._end = pos + read
+
+    def _slice(self, pos, length):
+        """ Returns up to `length` bytes starting at `pos`, without moving the cursor. """
+        if self._file is not None:
+            if length > self.block_size:
+                # Large reads (streams content) are not worth going through the window
+                return self._read_at(pos, length)
+
+            self._fill(pos, length)
+
+        offset = pos - self._start
+        tok = self._buffer[offset:min(offset + length, self._end - self._start)]
+        if not isinstance(tok, bytes):
+            tok = bytes(tok)
+
+        return tok
+
+    def _match(self, pattern, length=64):
+        """
+        Matches the given pattern at the current position.
+        The window is extended until the match no longer reaches its end.
+        """
+        while True:
+            if self._file is not None:
+                self._fill(self._pos, length)
+
+            offset = self._pos - self._start
+            end = self._end - self._start
+            match = pattern.match(self._buffer, offset, end)
+            if match.end() < end or self._end >= self._size:
+                return match
+
+            length *= 2
+
+    def _search(self, pattern, pos, overlap):
+        """ Returns the position of the first match of `pattern` at or after `pos`, or -1. """
+        while True:
+            if self._file is not None:
+                self._fill(pos, overlap + 1)
+
+            end = self._end - self._start
+            match = pattern.search(self._buffer, pos - self._start, end)
+            if match:
+                return self._start + match.start()
+
+            if self._end >= self._size:
+                return -1
+
+            pos = max(pos, self._end - overlap)
+
+    def _rfind(self, value, end):
+        """ Returns the position of the last occurrence of `value` ending at or before `end`, or -1. """
+        if self._file is None:
+            if hasattr(self._buffer, 'rfind'):
+                return self._buffer.rfind(value, 0, end)
+            return bytes(self._buffer[:end]).rfind(value)
+
+        window = max(self.block_size, len(value) * 2)
+        while end > 0:
+            start = max(0, end - window)
+            self._fill(start, end - start)
+            index = self._buffer.rfind(value, start - self._start, end - self._start)
+            if index > -1:
+                return self._start + index
+
+            if start == 0:
+                break
+            end = start + len(value) - 1
+
+        return -1
+
+    @classmethod
+    def _pattern(cls, values, ignore_eof):
+        key = (values, ignore_eof)
+        if key not in cls._patterns:
+            alternatives = [re.escape(v) for v in values]
+            if ignore_eof and b' ' in values:
+                # Line breaks are considered as spaces
+                alternatives += [b'\r', b'\n']
+            cls._patterns[key] = re.compile(b'|'.join(alternatives))
+
+        return cls._patterns[key]
+
+    def find(self, value, start=None):
+        """ Returns the position of the next occurrence of `value`, or -1. The cursor is not moved. """
+        if start is None:
+            start = self._pos
+
+        return self._search(self._pattern((value, ), False), start, len(value) - 1)
+
+    def view(self, pos, length):
+        """
+        Returns `length` bytes starting at `pos` without moving the cursor.
+        In-memory buffers (mmap, bytes, ...) are sliced through a memoryview, without any copy.
+        """
+        if self._file is not None:
+            return self._slice(pos, length)
+
+        return memoryview(self._buffer)[pos:pos + length]
+
+    def prefetch(self, pos, length):
+        """
+        Tells that the bytes in [pos, pos + length) are about to be read, so they
+        are read at once into the window of files. Mappings are advised to load them.
+        """
+        if self._file is not None:
+            self._fill(pos, length)
+        elif isinstance(self._buffer, mmap.mmap) and hasattr(self._buffer, 'madvise'):
+            start = pos - pos % mmap.PAGESIZE
+            try:
+                self._buffer.madvise(mmap.MADV_WILLNEED, start, min(pos + length, self._size) - start)
+            except (ValueError, OSError):
+                pass
+
+    def window(self, length):
+        """
+        Gives a direct access to the data following the current position.
+        Returns a (buffer, offset, end, eof) tuple: buffer[offset:end] holds at least
+        `length` bytes, unless `eof` is True, in which case `end` is the end of the stream.
+        """
+        if self._file is not None:
+            self._fill(self._pos, length)
+
+        return self._buffer, self._pos - self._start, self._end - self._start, self._end >= self._size
+
+    def chunks(self, overlap=64, chunk_size=16 * 1024 * 1024):
+        """
+        Yields (base, buffer, start, end) tuples covering the whole stream, to scan it with
+        regular expressions: buffer[start:end] are the bytes from position `base + start`,
+        and up to `overlap` bytes before and after them are available in the buffer,
+        so patterns can look around the scanned range.
+        In-memory buffers are yielded at once. The cursor is not moved.
+        """
+        if self._file is None:
+            yield 0, self._buffer, 0, self._size
+            return
+
+        position = 0
+        while position < self._size:
+            before = min(position, overlap)
+            buffer = self._read_at(position - before, before + chunk_size + overlap)
+            yield position - before, buffer, before, min(len(buffer), before + chunk_size)
+            position += chunk_size
+
     def read(self, length=1):
-        tok = self.stream.read(length)
+        tok = self._slice(self._pos, length)
         if not tok:
             raise PDFSurgeStreamError('Unexpected end of stream')
 
+        self._pos += len(tok)
         return tok
-    
+
     def seek(self, pos, cur=None):
-        if cur is None:
-            cur = io.SEEK_SET
+        if cur is None or cur == io.SEEK_SET:
+            position = pos
+        elif cur == io.SEEK_CUR:
+            position = self._pos + pos
+        elif cur == io.SEEK_END:
+            position = self._size + pos
+        else:
+            raise PDFSurgeStreamError('Invalid whence value {0}.'.format(cur))
 
-        return self.stream.seek(pos, cur)
+        if position < 0:
+            raise PDFSurgeStreamError('Negative seek position {0}.'.format(position))
+
+        self._pos = position
+        return position
 
     def readline(self, maxlength=1024):
-        return self.stream.readline(maxlength)
-    
+        line = self._slice(self._pos, maxlength)
+        index = line.find(b'\n')
+        if index > -1:
+            line = line[:index + 1]
+
+        self._pos += len(line)
+        return line
+
     def tell(self):
-        return self.stream.tell()
-    
+        return self._pos
+
     def peek(self, length=1):
-        pos = self.stream.tell()
-        tok = self.read(length)
-        self.seek(pos, io.SEEK_SET)
+        tok = self._slice(self._pos, length)
+        if not tok:
+            raise PDFSurgeStreamError('Unexpected end of stream')
 
         return tok
-    
+
     def around(self, length):
-        pos = self.stream.tell()
-        self.seek(length * -1, io.SEEK_CUR)
-        c = self.read(length * 2)
-        self.seek(pos, io.SEEK_SET)
-        return c
+        start = max(0, self._pos - length)
+        return self._slice(start, self._pos + length - start)
 
     def read_until_space(self, blocking=False):
-        chars = b''
-        while True:
-            x = self.read(1)
-            if not x: # EOF
-                break
-            if x.isspace():
-                if len(chars) > 0 or blocking:
-                    break
-                continue
-            chars += x
+        match = self._match(_re_word_blocking if blocking else _re_word)
+        chars = match.group(1)
+        if not chars and (not blocking or match.end() == match.start()):
+            raise PDFSurgeStreamError('Unexpected end of stream')
+
+        self._pos = self._start + match.end()
+        if not isinstance(chars, bytes):
+            chars = bytes(chars)
 
         return chars
 
     def read_until(self, value, reverse=False, ignore_eof=True):
-        length = 0
-        is_list = False
-
         if isinstance(value, (tuple, list)) and len(value) > 0:
-            is_list = True
-            length = len(value[0])
-            if not all(length == len(rest) for rest in value):
+            values = tuple(value)
+            length = len(values[0])
+            if not all(length == len(rest) for rest in values):
                 raise AttributeError('Each items of the list for the parameter values on "read_until" must have the same char length.')
         else:
+            values = (value, )
             length = len(value)
 
         if length == 0:
             return 0
 
         if reverse:
-            self.seek(length * -1, io.SEEK_CUR)
-            position = (length * -1)  -1
+            initial = self._pos - length
+            final = max(self._rfind(v, self._pos) for v in values)
         else:
-            position = ((length + 1) * -1) + 1
+            initial = self._pos
+            final = self._search(self._pattern(values, ignore_eof), initial, length - 1)
 
-        initial = self.tell()
-
-        while True:
-            v = self.read(length)
-            if v == b'\r':
-                if self.read(1) == b'\n' and ignore_eof:
-                    v = b' '
-                else:
-                    self.seek(-1, io.SEEK_CUR)
-            if ignore_eof and v == b'\n':
-                v = b' '
-
-            if is_list:
-                if v in value:
-                    break
-            elif v == value:
-                break
-
-            if not reverse:
-                if not self.read(1):
-                    # EOF
-                    return 0
-            try:
-                self.seek(position, io.SEEK_CUR)
-            except IOError:
-                return 0
-
-        self.seek(length * -1, io.SEEK_CUR)
-        final = self.tell()
+        if final < 0:
+            return 0
 
         if initial == final:
             content = None
         else:
-            self.seek(min(initial, final))
-            content = self.read(max(initial, final) - min(initial, final))
+            content = self._slice(min(initial, final), abs(initial - final))
 
-        self.seek(final)  # Because in reverse, final is before!
+        self._pos = final  # Because in reverse, final is before!
         return content
-    
-    def read_until_char(self):
-        while self.read(1).isspace():
-            continue
 
-        self.seek(-1, io.SEEK_CUR)
+    def read_until_char(self):
+        match = self._match(_re_spaces)
+        self._pos = self._start + match.end()
+        if self._pos >= self._size:
+            raise PDFSurgeStreamError('Unexpected end of stream')
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+
+__author__ = "Cyril Nicodeme"
+__author_email__ = "cyril@pdfshift.io"
+
+from .exceptions import PDFSurgeException, PDFParserException
+from array import array
+from bisect import bisect_right
+import re, sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+_ws = rb'\x00\t\n\x0c\r '
+_whitespaces = frozenset(b'\x00\t\n\x0c\r ')
+_not_regular = rb'(?![^' + _ws + rb'()<>\[\]{}/%])'
+
+# Searched as plain words, so the regular expression engine can skip to them quickly
+_re_obj = re.compile(rb'obj' + _not_regular)
+_re_trailer = re.compile(rb'trailer' + _not_regular)
+_re_type = re.compile(rb'/Type[' + _ws + rb']*/(XRef|ObjStm|Catalog)' + _not_regular)
+# The "idnum generation" preceding an "obj" keyword
+_re_obj_header = re.compile(rb'(?<!\d)(\d{1,10})[' + _ws + rb']+(\d{1,5})[' + _ws + rb']+\Z')
+
+
+def scan_objects(reader):
+    """
+    Scans the whole document for objects, to rebuild the xref index of a damaged file.
+
+    Returns three values:
+     - a dict of the objects found, mapping their number to their (offset, generation).
+       An object defined several times keeps its last definition, as incremental updates
+       are appended to the document.
+     - the positions following the "trailer" keywords.
+     - the (offset, number, kind) of the objects typed as /XRef, /ObjStm or /Catalog.
+
+    Each pattern is a plain word searched in large chunks (or in the whole mapping),
+    and the numbers preceding "obj" are only checked where it is found.
+    """
+    objects = {}
+    headers = []
+    headers_nums = []
+    trailers = []
+    types = []
+
+    for base, buffer, start, end in reader.chunks():
+        for match in _re_obj.finditer(buffer, start, len(buffer)):
+            position = match.start()
+            if position >= end:
+                break
+            if position == 0 or buffer[position - 1] not in _whitespaces:
+                continue  # "endobj", ...
+
+            header = _re_obj_header.search(buffer, max(0, position - 32), position)
+            if header is None:
+                continue
+
+            num, generation = int(header.group(1)), int(header.group(2))
+            objects[num] = (base + header.start(), generation)
+            headers.append(base + header.start())
+            headers_nums.append(num)
+
+        for match in _re_trailer.finditer(buffer, start, len(buffer)):
+            if match.start() >= end:
+                break
+            trailers.append(base + match.end())
+
+        for match in _re_type.finditer(buffer, start, len(buffer)):
+            if match.start() >= end:
+                break
+            types.append((base + match.start(), '/' + match.group(1).decode('ascii')))
+
+    markers = []
+    for position, kind in types:
+        # The object holding this /Type is the last one starting before it
+        index = bisect_right(headers, position) - 1
+        if index < 0:
+            continue
+
+        num = headers_nums[index]
+        offset = headers[index]
+        if objects[num][0] == offset:
+            markers.append((offset, num, kind))
+
+    return objects, trailers, markers
+
+
+def decode_xref_stream(data, widths):
+    """
+    Decodes the content of a cross-reference stream (PDF 1.5+) in one pass.
+
+    `widths` is the /W array of the stream, giving the size in bytes of each
+    of the three fields of an entry. Returns three parallel typed arrays: the
+    types ('B'), the second fields ('Q') and the third fields of every entries
+    ('I', or 'Q' when they are wider than 4 bytes), ready for XrefIndex.update.
+
+    PDF Spec Table 17: A value of zero for an element in the W array indicates
+    that the field is not present, the default value shall be used instead
+    (1 for the type, 0 for the other fields).
+    """
+    if len(widths) != 3 or any(w < 0 or w > 8 for w in widths):
+        raise PDFSurgeException('Invalid /W array {0} for the xref stream.'.format(widths))
+
+    entry_size = sum(widths)
+    count = len(data) // entry_size if entry_size else 0
+    typecodes = (
+        'B' if widths[0] <= 1 else 'Q',
+        'Q',
+        'I' if widths[2] <= array('I').itemsize else 'Q'
+    )
+
+    if numpy is not None:
+        types, fields, indexes = _decode_numpy(data, widths, entry_size, count, typecodes)
+    else:
+        types, fields, indexes = _decode_python(data, widths, entry_size, count, typecodes)
+
+    if types.typecode != 'B':
+        if types and max(types) > 0xFF:
+            raise PDFSurgeException('Unknow xref type {0}'.format(max(types)))
+        types = array('B', types)
+
+    return types, fields, indexes
+
+
+def decode_xref_entry(data, widths, position):
+    """ Decodes the (type, field, index) entry of a cross-reference stream starting at `position` """
+    entry = []
+    for i, width in enumerate(widths):
+        if width == 0:
+            entry.append(1 if i == 0 else 0)
+        else:
+            entry.append(int.from_bytes(data[position:position + width], 'big'))
+            position += width
+
+    return tuple(entry)
+
+
+def _decode_numpy(data, widths, entry_size, count, typecodes):
+    entries = numpy.frombuffer(data, dtype=numpy.uint8, count=count * entry_size).reshape(count, entry_size)
+
+    fields = []
+    position = 0
+    for i, (width, typecode) in enumerate(zip(widths, typecodes)):
+        if width == 0:
+            fields.append(array(typecode, [1 if i == 0 else 0]) * count)
+            continue
+
+        values = entries[:, position].astype(numpy.uint64)
+        for column in range(position + 1, position + width):
+            values = (values << numpy.uint64(8)) | entries[:, column]
+
+        # Native order, as the arrays
+        itemsize = array(typecode).itemsize
+        fields.append(array(typecode, values.astype('=u{0}'.format(itemsize)).tobytes()))
+        position += width
+
+    return tuple(fields)
+
+
+def _decode_python(data, widths, entry_size, count, typecodes):
+    data = bytes(data[:count * entry_size])
+
+    fields = []
+    position = 0
+    for i, (width, typecode) in enumerate(zip(widths, typecodes)):
+        if width == 0:
+            fields.append(array(typecode, [1 if i == 0 else 0]) * count)
+            continue
+
+        # Each column of the entries is a strided slice of the data, copied at its place
+        # in big-endian integers of the size of the array items, so the whole field is
+        # converted at once.
+        itemsize = array(typecode).itemsize
+        values = bytearray(count * itemsize)
+        for column in range(width):
+            values[itemsize - width + column::itemsize] = data[position + column::entry_size]
+
+        field = array(typecode, bytes(values))
+        if sys.byteorder == 'little' and itemsize > 1:
+            field.byteswap()
+
+        fields.append(field)
+        position += width
+
+    return tuple(fields)
+
+
+# Largest offsets (or object stream numbers) and generations (or indexes) the arrays can hold
+_max_field = 2 ** (8 * array('Q').itemsize) - 1
+_max_index = 2 ** (8 * array('I').itemsize) - 1
+
+
+def _typed(typecode, values):
+    """ Returns the given values as an array of the given type """
+    if isinstance(values, array) and values.typecode == typecode:
+        return values
+
+    return array(typecode, values)
+
+
+# Entries types, as in the cross-reference streams (PDF spec table 18)
+FREE = 0
+IN_USE = 1
+COMPRESSED = 2
+# The xref sections read so far don't mention this object
+UNSET = 3
+
+
+class XrefIndex:
+    """
+    Cross-reference index of a document, telling where each object is stored.
+
+    Entries are kept in three parallel typed arrays, indexed by object number:
+    the type of the entry (1 byte), the offset of the object or the number of the
+    object stream holding it (8 bytes), and the generation of the object or its
+    index in the object stream (4 bytes).
+    An object number defined with several generations (which is rare) keeps the
+    first one in the arrays, the others are stored in a sparse overflow dict.
+
+    The arrays only grow up to the expected number of objects (see expect()), or
+    `slack` entries past their length. Entries of objects numbered beyond that,
+    as found in damaged or hostile documents, are stored in a sparse dict instead,
+    so a single huge object number doesn't allocate gigabytes.
+
+    As xref sections are read from the newest to the oldest, an entry never
+    replaces one that was already recorded.
+    The type of an entry is written last, so entries can be read while another
+    thread is recording a section.
+    """
+    slack = 64 * 1024
+
+    def __init__(self, size=0):
+        self._types = array('B', [UNSET]) * size
+        self._fields = array('Q', [0]) * size
+        self._indexes = array('I', [0]) * size
+        self._overflow = {}
+        # num: (type, field, index) of the objects numbered beyond the arrays
+        self._sparse = {}
+        self._expected = size
+
+    def __getstate__(self):
+        """ The arrays as bytes, so the index can be stored (IndexCache) or pickled """
+        return (self._types.tobytes(), self._fields.tobytes(), self._indexes.tobytes(), self._overflow, self._sparse)
+
+    def __setstate__(self, state):
+        types, fields, indexes, overflow, sparse = state
+        self._types = array('B', types)
+        self._fields = array('Q')
+        self._fields.frombytes(fields)
+        self._indexes = array('I')
+        self._indexes.frombytes(indexes)
+        self._overflow = dict(overflow)
+        self._sparse = dict(sparse)
+        self._expected = len(self._types)
+
+        if not len(self._types) == len(self._fields) == len(self._indexes):
+            raise PDFSurgeException('Invalid xref index state.')
+
+    def __len__(self):
+        """ Number of objects in use (including compressed ones) """
+        in_use = sum(1 for xref_type, _, _ in self._sparse.values() if xref_type == IN_USE or xref_type == COMPRESSED)
+        return len(self._types) - self._types.count(UNSET) - self._types.count(FREE) + len(self._overflow) + in_use
+
+    def __contains__(self, num):
+        if 0 <= num < len(self._types):
+            return self._types[num] in (IN_USE, COMPRESSED)
+
+        return num in self._sparse and self._sparse[num][0] in (IN_USE, COMPRESSED)
+
+    def expect(self, size):
+        """ Lets the arrays grow up to `size` objects, usually the /Size of the trailer """
+        self._expected = max(self._expected, size)
+
+    def _grow(self, size, entries=1):
+        """
+        Grows the arrays to hold `size` objects, for `entries` new entries.
+        Returns False when it would grow them too much, the entries must go to the sparse dict.
+        """
+        missing = size - len(self._types)
+        if missing <= 0:
+            return True
+
+        limit = max(self._expected, len(self._types) + self.slack + entries)
+        if size > limit:
+            return False
+
+        missing = min(max(missing, len(self._types) // 2), limit - len(self._types))
+        # The types last: get() relies on their length
+        self._fields.extend(array('Q', [0]) * missing)
+        self._indexes.extend(array('I', [0]) * missing)
+        self._types.extend(array('B', [UNSET]) * missing)
+        return True
+
+    def add(self, num, xref_type, field, index):
+        """
+        Records an entry: `field` and `index` are the offset and the generation for
+        objects in use, the object stream number and the index for compressed objects.
+        Raises a PDFParserException when they don't fit in the arrays.
+        """
+        if not (0 <= field <= _max_field and 0 <= index <= _max_index):
+            raise PDFParserException('Invalid xref entry {0} {1} for object {2}.'.format(field, index, num))
+
+        if num >= len(self._types) and not self._grow(num + 1):
+            current = self._sparse.setdefault(num, (xref_type, field, index))
+            if xref_type == IN_USE and current[0] == IN_USE and current[2] != index:
+                self._overflow.setdefault((num, index), field)
+            return
+
+        current = self._types[num]
+        if current == UNSET:
+            self._fields[num] = field
+            self._indexes[num] = index
+            self._types[num] = xref_type
+        elif xref_type == IN_USE and current == IN_USE and self._indexes[num] != index:
+            self._overflow.setdefault((num, index), field)
+
+    def update(self, start, types, fields, indexes):
+        """ Records the consecutive entries of an xref section starting at object number `start`, see add() """
+        end = start + len(types)
+        if self._grow(end, len(types)) and self._types[start:end].count(UNSET) == end - start:
+            # None of these objects were defined before, the section is copied at once.
+            # Typed arrays (as given by decode_xref_stream) are copied without conversion.
+            try:
+                fields, indexes = _typed('Q', fields), _typed('I', indexes)
+            except OverflowError:
+                raise PDFParserException('Invalid xref entries for objects {0} to {1}.'.format(start, end - 1))
+
+            self._fields[start:end] = fields
+            self._indexes[start:end] = indexes
+            self._types[start:end] = _typed('B', types)
+            return
+
+        for i in range(len(types)):
+            self.add(start + i, types[i], fields[i], indexes[i])
+
+    def get(self, num, generation=0):
+        """
+        Returns the (type, field, index) entry of the given object, or None when the
+        object is not in use. The generation is ignored for compressed objects (always 0).
+        """
+        if num < 0:
+            return None
+
+        if num < len(self._types):
+            xref_type, field, index = self._types[num], self._fields[num], self._indexes[num]
+        elif num in self._sparse:
+            xref_type, field, index = self._sparse[num]
+        else:
+            return None
+
+        if xref_type == IN_USE:
+            if index == generation:
+                return (IN_USE, field, generation)
+        elif xref_type == COMPRESSED:
+            return (COMPRESSED, field, index)
+
+        if (num, generation) in self._overflow:
+            return (IN_USE, self._overflow[(num, generation)], generation)
+
+        return None
+
+    def items(self):
+        """ Yields the (num, type, field, index) of every object in use """
+        for num, xref_type in enumerate(self._types):
+            if xref_type == IN_USE or xref_type == COMPRESSED:
+                yield num, xref_type, self._fields[num], self._indexes[num]
+
+        for num, (xref_type, field, index) in sorted(self._sparse.items()):
+            if xref_type == IN_USE or xref_type == COMPRESSED:
+                yield num, xref_type, field, index
+
+        for (num, generation), offset in self._overflow.items():
+            yield num, IN_USE, offset, generation